@@ -0,0 +1,90 @@
+# Copyright 2019 ML2Grow NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Throughput benchmarks of udatastore against the in-memory client, in documents per second.
+
+Running without network isolates the overhead of udatastore itself, use --latency to
+simulate round-trips:
+
+    python benchmarks/bench.py --sizes 1000 100000 --latency 0.01 --workers 4
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from umongo import Document, fields
+
+from udatastore import DataStoreInstance
+from udatastore.memory import MemoryClient
+
+
+CATEGORIES = ['c{0}'.format(i) for i in range(10)]
+
+
+class BenchTempl(Document):
+    name = fields.StringField(required=True)
+    category = fields.StringField(required=True)
+    rank = fields.IntegerField()
+    created = fields.DateTimeField()
+    tags = fields.ListField(fields.StringField())
+
+
+def measure(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def run(size, latency=0.0, workers=1):
+    client = MemoryClient(latency=latency)
+    instance = DataStoreInstance()
+    instance.init(client, workers=workers)
+    Bench = instance.register(BenchTempl)  # pylint: disable=C0103
+
+    now = datetime(2019, 1, 1)
+    docs = [Bench(name='doc{0}'.format(i), category=CATEGORIES[i % len(CATEGORIES)], rank=i,
+                  created=now + timedelta(seconds=i), tags=['a', 'b']) for i in range(size)]
+    results = [('commit_multi', measure(lambda: Bench.commit_multi(docs)))]
+
+    pks = [doc.pk for doc in docs]
+    results.append(('get_multi', measure(lambda: Bench.get_multi(pks))))
+    results.append(('find $in', measure(lambda: list(Bench.find({'category': {'$in': CATEGORIES}})))))
+
+    payloads = [doc.to_mongo() for doc in docs]
+    results.append(('build_from_mongo', measure(lambda: [Bench.build_from_mongo(p) for p in payloads])))
+    entities = Bench.collection.get_multi(pks, raw=True)
+    results.append(('build_from_entity', measure(lambda: [Bench.build_from_entity(e) for e in entities])))
+    results.append(('build_from_entity lazy', measure(
+        lambda: [Bench.build_from_entity(e, lazy=True) for e in entities])))
+    results.append(('dump', measure(lambda: [doc.dump() for doc in docs])))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated seconds per RPC')
+    parser.add_argument('--workers', type=int, default=1, help='concurrent chunks per batch operation')
+    args = parser.parse_args()
+
+    print('{0:<24}{1:>10}{2:>12}{3:>14}'.format('operation', 'documents', 'seconds', 'documents/s'))
+    for size in args.sizes:
+        for operation, elapsed in run(size, latency=args.latency, workers=args.workers):
+            print('{0:<24}{1:>10}{2:>12.3f}{3:>14.0f}'.format(operation, size, elapsed, size / elapsed))
+
+
+if __name__ == '__main__':
+    main()
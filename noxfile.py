@@ -31,3 +31,11 @@ def lint(session):
     session.install('-e', '.')
 
     session.run('pylint_runner', 'udatastore')
+
+
+@nox.session(python="3.6")
+def bench(session):
+    session.install('-e', '.')
+
+    # Throughput against the in-memory client, e.g. nox -s bench -- --sizes 1000 100000
+    session.run('python', 'benchmarks/bench.py', *session.posargs)
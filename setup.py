@@ -47,7 +47,8 @@ setup(
     long_description_content_type='text/markdown',
     packages=find_packages(exclude=('tests*',)),
     extras_require={
-        'test': ['nox']
+        'test': ['nox'],
+        'numpy': ['numpy']
     },
     include_package_data=True,
     install_requires=REQUIREMENTS,
@@ -1,12 +1,18 @@
+import os
+
 from google.cloud import datastore
 import pytest
 from udatastore import DataStoreInstance
+from udatastore.memory import MemoryClient
 
 
 @pytest.fixture
 def client():
+    if os.environ.get('UDATASTORE_TEST_CLIENT') == 'memory':
+        yield MemoryClient(project='ml2grow-intern', namespace='abcd')
+        return
     cl = datastore.Client(project='ml2grow-intern', namespace='abcd')
-    for kind in ["UserTempl", "ModelTempl", "User", "IncorrectTempl", "Recipe", "RecipeTempl", "RecipeTemplEnc", "Pokemon", "PokemonTempl"]:
+    for kind in ["UserTempl", "ModelTempl", "User", "IncorrectTempl", "Recipe", "RecipeTempl", "RecipeTemplEnc", "Pokemon", "PokemonTempl", "TeamTempl", "PlayerTempl", "ConfigTempl", "CityTempl", "ProfileTempl", "ArchiveTempl", "BlobTempl", "ScanTempl", "UdatastoreShard", "LazyArchiveTempl", "JournalTempl", "AccountTempl", "MemberTempl", "GaugeTempl", "GadgetTempl", "WidgetTempl", "EventTempl", "ReadingTempl", "TileTempl", "SettingsTempl", "CachedTileTempl", "ShelfTempl", "BoardTempl", "MemoTempl"]:
         for e in cl.query(kind=kind).fetch():
             cl.delete(e.key)
     yield cl
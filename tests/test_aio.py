@@ -0,0 +1,49 @@
+import asyncio
+
+from umongo import Document, fields
+
+from udatastore.aio import gather_get_multi
+
+
+class CityTempl(Document):
+    name = fields.StringField(required=True)
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_async_crud(instance):
+    City = instance.register(CityTempl)
+
+    async def scenario():
+        ghent = City(name='Ghent')
+        await ghent.async_commit()
+        assert ghent.is_created
+        found = await City.async_get(ghent.pk)
+        assert found == ghent
+        assert await City.async_count() == 1
+        await ghent.async_delete()
+        return await City.async_find_one()
+
+    assert run(scenario()) is None
+
+
+def test_async_find_and_gather(instance):
+    City = instance.register(CityTempl)
+    cities = [City(name='city{0}'.format(i)) for i in range(5)]
+    City.commit_multi(cities)
+
+    async def scenario():
+        cursor = City.async_find(page_size=2, order=['name'])
+        names = [city.name async for city in cursor]
+        found = await gather_get_multi((City, [c.pk for c in cities[:2]]), (City, [cities[4].pk]))
+        return names, found
+
+    names, found = run(scenario())
+    assert names == ['city{0}'.format(i) for i in range(5)]
+    assert found == [cities[:2], [cities[4]]]
@@ -1,10 +1,13 @@
 from google.cloud import datastore
 from umongo import Document, fields, validate
+from umongo.exceptions import ValidationError
 from umongo.fields import StringField
 
 from udatastore.helpers import DataStoreClientWrapper
 from udatastore.builder import DataStoreBuilder
+from udatastore.cache import LRUCache
 from udatastore.fields import BytesField, DictField
+from udatastore import prefetch
 from datetime import datetime
 import pytest
 import pickle
@@ -105,6 +108,8 @@ def test_attribute(instance):
     assert found.name == "abcdef"
     assert found.pk == f.pk
     assert found.dump() == {'name': 'abcdef', 'number': '034407777'}
+    assert found._data._data['_id'] == f.pk
+    assert found._data._key_fields == {'_id'}
 
 
 class RecipeTempl(Document):
@@ -146,6 +151,164 @@ def test_bytes_field_numpy(instance, client):
     assert np.allclose(found.mix, t)
 
 
+class BlobTempl(Document):
+    name = StringField()
+    legacy = BytesField(compression='zlib', compress_threshold=16)
+    raw = BytesField(codec='raw', compression='lzma', compress_threshold=0)
+    array = BytesField(codec='numpy', reuse_encoded=True)
+
+
+def test_bytes_field_codecs(instance, client):
+    Blob = instance.register(BlobTempl)
+    t = np.arange(12, dtype='>i4').reshape(3, 4)
+    b = Blob(name='a', legacy=list(range(50)), raw=b'\x00' * 100, array=t)
+    b.commit()
+    stored = client.get(b.pk)
+    assert stored['legacy'][:3] == b'\x00\x01\x01'
+    assert stored['raw'][:3] == b'\x00\x02\x02'
+    assert stored['array'][:3] == b'\x00\x03\x00'
+
+    # Plain pickles written before the codec was set still load
+    stored['legacy'] = pickle.dumps({'a': 1})
+    client.put(stored)
+    found = Blob.get(b.pk)
+    assert found.legacy == {'a': 1}
+    assert found.raw == b'\x00' * 100
+    assert found.array.dtype == t.dtype and np.array_equal(found.array, t)
+
+    # Unchanged blobs are not encoded again
+    encoded = found._data.to_mongo()['array']
+    found.name = 'b'
+    assert found._data.to_mongo()['array'] is encoded
+    found.commit()
+    assert found._data.to_mongo()['array'] is encoded
+    found.array = t[:1]
+    assert found._data.to_mongo()['array'] is not encoded
+    assert Blob.get(b.pk).name == 'b'
+
+    # Mutable values may change in place, these are encoded again
+    found = Blob.get(b.pk)
+    found.legacy['b'] = 2
+    found.name = 'c'
+    found.commit()
+    assert Blob.get(b.pk).legacy == {'a': 1, 'b': 2}
+
+    with pytest.raises(ValidationError):
+        Blob(raw=[1, 2])
+
+
+class ScanTempl(Document):
+    name = StringField()
+    image = BytesField(codec='raw', shard_size=1000)
+
+
+def test_bytes_field_sharded(instance, client):
+    Scan = instance.register(ScanTempl)
+    image = bytes(range(256)) * 10
+    scans = [Scan(name='big', image=image), Scan(name='small', image=b'abc')]
+    Scan.commit_multi(scans)
+    assert all(s.is_created for s in scans)
+    shard_keys = [e.key for e in client.query(kind='UdatastoreShard', ancestor=scans[0].pk).fetch()]
+    assert sorted(k.name for k in shard_keys) == ['image:0', 'image:1', 'image:2']
+    assert not list(client.query(kind='UdatastoreShard', ancestor=scans[1].pk).fetch())
+
+    # Shards are only fetched when the field is accessed
+    found = Scan.find_one({'name': 'big'})
+    assert found.name == 'big'
+    rpcs = getattr(client, 'rpc_count', None)
+    assert found.image == image
+    assert rpcs is None or client.rpc_count == rpcs + 1
+    assert found.dump()['image'] == Scan.schema.fields['image'].encode(image)
+    assert Scan.get(scans[1].pk).image == b'abc'
+
+    # Unchanged shards are not written again
+    found.name = 'bigger'
+    assert found._data.to_mongo()['image'] == client.get(found.pk)['image']
+    found.commit()
+    assert Scan.get(found.pk).image == image
+
+    Scan.delete_multi(scans)
+    assert not list(client.query(kind='UdatastoreShard', ancestor=scans[0].pk).fetch())
+
+
+class TileTempl(Document):
+    name = StringField()
+    image = BytesField(codec='raw', shard_size=10)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_bytes_field_sharded_chunks(instance, client, monkeypatch, workers):
+    Tile = instance.register(TileTempl)
+    allocate_ids = client.allocate_ids
+    allocated = []
+    monkeypatch.setattr(client, 'allocate_ids', lambda key, n: allocated.append(n) or allocate_ids(key, n))
+    images = [bytes([i]) * 50 for i in range(30)]
+    # Each document is written with 5 shards, chunks of 20 entities hold 3 documents
+    tiles = list(Tile.commit_stream((Tile(name=str(i), image=image) for i, image in enumerate(images)),
+                                    size=20, workers=workers))
+    assert len(tiles) == 30 and all(tile.is_created for tile in tiles)
+    assert [Tile.get(tile.pk).image for tile in tiles] == images
+
+    # Ids are allocated once per chunk of payloads
+    allocated.clear()
+    tiles = [Tile(name='multi', image=b'x' * 50) for _ in range(120)]
+    Tile.commit_multi(tiles)
+    assert allocated == [120]
+    assert len({tile.pk for tile in tiles}) == 120
+    assert all(Tile.get(tile.pk).image == b'x' * 50 for tile in tiles[::17])
+
+
+class CachedTileTempl(Document):
+    name = StringField()
+    image = BytesField(codec='raw', shard_size=10)
+
+    class Meta:
+        cache = LRUCache()
+
+
+def test_bytes_field_sharded_io(instance, client, monkeypatch):
+    Tile = instance.register(CachedTileTempl)
+    tiles = [Tile(name=str(i), image=bytes([i]) * 25) for i in range(20)]
+    Tile.commit_multi(tiles)
+
+    # Shards are fetched through the collection, and its cache
+    cache = Tile.opts.cache
+    hits = cache.hits
+    assert Tile.find_one({'name': '3'}).image == bytes([3]) * 25
+    assert Tile.find_one({'name': '3'}).image == bytes([3]) * 25
+    assert cache.hits == hits + 3
+
+    # Rewritten shards are evicted from the cache
+    found = Tile.find_one({'name': '3'})
+    found.image = b'new' * 10
+    found.commit()
+    assert Tile.find_one({'name': '3'}).image == b'new' * 10
+
+    # Shards left over by values which shrink are deleted
+    def shard_names(tile):
+        return sorted(e.key.name for e in client.query(kind='UdatastoreShard', ancestor=tile.pk).fetch())
+
+    shrunk = [Tile.find_one({'name': name}) for name in ('4', '5', '6')]
+    shrunk[0].image = b'y' * 15
+    shrunk[1].image = b'tiny'
+    Tile.commit_multi(shrunk[:2])
+    with instance.transaction():
+        shrunk[2].image = b'z' * 5
+        shrunk[2].commit()
+    assert [shard_names(tile) for tile in shrunk] == [['image:0', 'image:1'], [], []]
+    assert [Tile.get(tile.pk).image for tile in shrunk] == [b'y' * 15, b'tiny', b'z' * 5]
+
+    # The shards of all documents are looked up at once
+    queries = []
+    query = client.query
+    monkeypatch.setattr(client, 'query', lambda **kwargs: queries.append(kwargs) or query(**kwargs))
+    Tile.delete_multi(tiles)
+    assert queries == []
+    monkeypatch.undo()
+    assert not list(client.query(kind='UdatastoreShard').fetch())
+    assert Tile.count() == 0
+
+
 class PokemonTempl(Document):
     name = StringField(required=True)
     attributes = DictField(required=True)
@@ -160,3 +323,199 @@ def test_dict_field(instance):
     found = Pokemon.find_one({'_id': venusaur.pk})
 
     assert attr_dict == found.attributes
+
+
+class TeamTempl(Document):
+    name = StringField(required=True)
+
+
+class PlayerTempl(Document):
+    name = StringField(required=True)
+    team = fields.ReferenceField("TeamTempl")
+    friends = fields.ListField(fields.ReferenceField("PlayerTempl"))
+
+
+def test_prefetch(instance):
+    Team = instance.register(TeamTempl)
+    Player = instance.register(PlayerTempl)
+    red = Team(name='red')
+    red.commit()
+    goku = Player(name='goku', team=red)
+    goku.commit()
+    vegeta = Player(name='vegeta', friends=[goku])
+    vegeta.commit()
+
+    found = list(Player.find({'name': 'vegeta'}, prefetch=['friends.team']))
+    assert len(found) == 1
+    friend = found[0].friends[0]
+    assert friend._document == goku
+    assert friend._document.team._document == red
+    assert friend.fetch() is friend._document
+
+    found = Player.find_one({'name': 'goku'})
+    prefetch([found], 'team', 'friends')
+    assert found.team._document == red
+
+
+def test_commit_stream(instance):
+    User = instance.register(UserTempl)
+    users = (User(email='user{0}@sayen.com'.format(i)) for i in range(12))
+    committed = list(User.commit_stream(users, size=5))
+    assert len(committed) == 12
+    assert all(u.is_created and isinstance(u.pk, datastore.Key) for u in committed)
+    assert User.count() == 12
+
+
+def test_find_pages(instance):
+    User = instance.register(UserTempl)
+    User.commit_multi([User(email='user{0}@sayen.com'.format(i)) for i in range(7)])
+
+    cursor = User.find(page_size=3, order=['email'])
+    first = cursor.next_page()
+    assert [u.email for u in first] == ['user0@sayen.com', 'user1@sayen.com', 'user2@sayen.com']
+    assert cursor.next_cursor is not None
+
+    resumed = User.find(page_size=3, order=['email'], start_cursor=cursor.next_cursor)
+    pages = list(resumed.pages())
+    assert [len(page) for page in pages] == [3, 1]
+    assert pages[-1][0].email == 'user6@sayen.com'
+    assert resumed.next_cursor is None
+    assert len(list(User.find(page_size=3, limit=5))) == 5
+
+
+def test_scan(instance):
+    User = instance.register(UserTempl)
+    users = [User(email='user{0}@sayen.com'.format(i)) for i in range(40)]
+    User.commit_multi(users)
+
+    ranges = User.key_ranges(4)
+    assert 1 < len(ranges) <= 4
+    assert ranges[0][0] is None and ranges[-1][1] is None
+    cursors = User.scan(partitions=4)
+    assert len(cursors) == len(ranges)
+    scanned = [u.pk for cursor in cursors for u in cursor]
+    assert sorted(scanned, key=lambda k: k.id) == sorted((u.pk for u in users), key=lambda k: k.id)
+
+    cursors = User.scan({'email': 'user7@sayen.com'}, partitions=4, keys_only=True)
+    assert [key for cursor in cursors for key in cursor] == [users[7].pk]
+    assert len(User.scan(partitions=1)) == 1
+    with pytest.raises(ValueError):
+        User.find({'id': users[0].pk.id}, key_range=ranges[0])
+
+
+def test_find_keys_only_projection(instance, client, monkeypatch):
+    User = instance.register(UserTempl)
+    goku = User(email='goku@sayen.com', birthday=datetime(1984, 11, 20))
+    goku.commit()
+
+    assert list(User.find(keys_only=True)) == [goku.pk]
+
+    found = next(User.find(projection=["email"]))
+    assert found.pk == goku.pk
+    assert found.email == goku.email
+    with pytest.raises(Exception):
+        found.birthday
+    with pytest.raises(ValidationError):
+        found.commit()
+
+    # A projection on the key alone runs a keys-only query
+    queries = []
+    query = client.query
+    monkeypatch.setattr(client, 'query', lambda **kwargs: queries.append(kwargs) or query(**kwargs))
+    found = next(User.find(projection=["id"]))
+    assert [q['projection'] for q in queries] == [('__key__', )]
+    assert found.pk == goku.pk
+    with pytest.raises(Exception):
+        found.email
+    with pytest.raises(ValidationError):
+        found.commit()
+
+
+def test_session(instance):
+    User = instance.register(UserTempl)
+    goku = User(email='goku@sayen.com')
+    goku.commit()
+    vegeta = User(email='vegeta@over9000.com', friend=goku)
+    vegeta.commit()
+
+    with instance.session():
+        found = User.get(goku.pk)
+        assert User.get(goku.pk) is found
+        assert User.find_one({'email': 'goku@sayen.com'}) is found
+        assert User.get(vegeta.pk).friend.fetch() is found
+    assert User.get(goku.pk) is not found
+
+    with instance.session(defer_commits=True) as session:
+        gohan = User(email='gohan@sayen.com')
+        gohan.commit()
+        assert not gohan.is_created
+        session.flush()
+        assert gohan.is_created
+        assert User.get(gohan.pk) is gohan
+        goten = User(email='goten@sayen.com')
+        goten.commit()
+    assert goten.is_created
+    assert User.count() == 4
+
+
+class ProfileTempl(Document):
+    name = StringField(required=True)
+    joined = fields.DateTimeField()
+    mix = BytesField()
+    attributes = DictField()
+    tags = fields.ListField(fields.StringField())
+    friends = fields.ListField(fields.ReferenceField("ProfileTempl"))
+
+
+def test_build_from_entity(instance, client):
+    Profile = instance.register(ProfileTempl)
+    goku = Profile(name='goku')
+    goku.commit()
+    vegeta = Profile(name='vegeta', joined=datetime(1984, 11, 20), mix=[1, 2], attributes={'H.P.': 9000},
+                     tags=['prince'], friends=[goku])
+    vegeta.commit()
+
+    entity = client.get(vegeta.pk)
+    hydrated = Profile.build_from_entity(entity)
+    built = Profile.build_from_mongo(Profile.collection._unpack(entity))
+    assert hydrated._data == built._data
+    assert hydrated.is_created and not hydrated.is_modified()
+    assert hydrated.dump() == built.dump()
+    assert hydrated.friends[0].fetch() == goku
+    assert Profile.build_from_entity(client.get(goku.pk))._data == Profile.get(goku.pk)._data
+
+
+class MemberTempl(Document):
+    name = StringField(required=True)
+
+    class Meta:
+        parent = TeamTempl
+
+
+def test_ancestor(instance):
+    Team = instance.register(TeamTempl)
+    Member = instance.register(MemberTempl)
+    teams = [Team(name='red'), Team(name='blue')]
+    Team.commit_multi(teams)
+
+    with pytest.raises(ValidationError):
+        Member(name='nobody').commit()
+    with pytest.raises(ValidationError):
+        Member(name='x').set_parent(Member.collection.key(1))
+
+    members = [Member(name=name).set_parent(team) for name, team in (('a', teams[0]), ('b', teams[0]),
+                                                                      ('c', teams[1]))]
+    Member.commit_multi(members)
+    assert members[0].pk.parent == teams[0].pk
+    assert members[0].parent_key == teams[0].pk
+    assert sorted(m.name for m in Member.find(ancestor=teams[0])) == ['a', 'b']
+    assert Member.find_one({'name': 'c'}, ancestor=teams[1].pk) == members[2]
+    assert Member.count(ancestor=teams[1]) == 1
+
+    # Entities are matched on their full key
+    flat = Member.collection.key(members[0].pk.id_or_name)
+    assert Member.get_multi([members[1].pk, flat, members[0].pk]) == [members[1], None, members[0]]
+
+    members[0].name = 'z'
+    members[0].reload()
+    assert members[0].name == 'a'
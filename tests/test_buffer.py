@@ -0,0 +1,84 @@
+from concurrent.futures import wait
+
+from umongo import Document, fields
+from umongo.exceptions import ValidationError
+import pytest
+
+from udatastore import DataStoreInstance
+from udatastore.buffer import WriteBuffer
+from udatastore.helpers import BatchError
+
+
+class EventTempl(Document):
+    name = fields.StringField(required=True)
+    value = fields.IntegerField()
+
+
+@pytest.fixture
+def buffered(client):
+    inst = DataStoreInstance()
+    inst.init(client, write_buffer=WriteBuffer(size=3, linger=60))
+    return inst
+
+
+def _counting_puts(client, monkeypatch):
+    put_multi = client.put_multi
+    calls = []
+
+    def counting(entities):
+        calls.append(len(entities))
+        return put_multi(entities)
+
+    monkeypatch.setattr(client, 'put_multi', counting)
+    return calls
+
+
+def test_write_buffer(buffered, client, monkeypatch):
+    Event = buffered.register(EventTempl)
+    calls = _counting_puts(client, monkeypatch)
+
+    events = [Event(name=str(i), value=i) for i in range(4)]
+    futures = [event.commit() for event in events]
+    # The third commit fills the buffer, written by the background thread
+    wait(futures[:3], timeout=5)
+    assert [f.result() for f in futures[:3]] == events[:3]
+
+    buffered.write_buffer.flush()
+    assert futures[3].result() is events[3]
+    assert all(event.is_created for event in events)
+    assert calls == [3, 1]
+    assert sorted(e.value for e in Event.find()) == [0, 1, 2, 3]
+
+    # Not modified, nothing to write
+    assert events[0].commit() is not None
+    buffered.write_buffer.flush()
+    assert calls == [3, 1]
+
+
+def test_write_buffer_errors(buffered, client, monkeypatch):
+    Event = buffered.register(EventTempl)
+    valid, invalid = Event(name='valid'), Event(value=1)
+    futures = [valid.commit(), invalid.commit()]
+    assert valid.commit() is futures[0]
+    buffered.write_buffer.flush()
+    assert futures[0].result() is valid
+    with pytest.raises(ValidationError):
+        futures[1].result()
+
+    def failing(entities):
+        raise RuntimeError('unavailable')
+
+    monkeypatch.setattr(client, 'put_multi', failing)
+    future = Event(name='lost').commit()
+    buffered.write_buffer.flush()
+    with pytest.raises(BatchError):
+        future.result()
+
+
+def test_write_buffer_linger(client):
+    inst = DataStoreInstance()
+    inst.init(client, write_buffer=WriteBuffer(linger=0.01))
+    Event = inst.register(EventTempl)
+    event = Event(name='late')
+    assert event.commit().result(timeout=5) is event
+    assert event.is_created
@@ -0,0 +1,76 @@
+from google.cloud import datastore
+from umongo import Document, fields
+
+from udatastore.cache import LRUCache
+from udatastore.fields import DictField
+
+
+def _entity(client, ident):
+    entity = datastore.Entity(key=client.key('Config', ident))
+    entity['value'] = ident
+    return entity
+
+
+def test_lru_eviction(client):
+    cache = LRUCache(max_size=2)
+    cache.set_multi([_entity(client, 1), _entity(client, 2)])
+    assert set(cache.get_multi([client.key('Config', 1)])) == {client.key('Config', 1)}
+    cache.set_multi([_entity(client, 3)])
+    found = cache.get_multi([client.key('Config', i) for i in (1, 2, 3)])
+    assert set(found) == {client.key('Config', 1), client.key('Config', 3)}
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_lru_ttl(client):
+    now = [0]
+    cache = LRUCache(ttl=10, timer=lambda: now[0])
+    cache.set_multi([_entity(client, 1)])
+    assert len(cache.get_multi([client.key('Config', 1)])) == 1
+    now[0] = 10
+    assert cache.get_multi([client.key('Config', 1)]) == {}
+    assert len(cache) == 0
+
+
+class ConfigTempl(Document):
+    name = fields.StringField(required=True)
+
+    class Meta:
+        cache = LRUCache()
+
+
+def test_document_cache(instance):
+    Config = instance.register(ConfigTempl)
+    cache = Config.opts.cache
+    config = Config(name='a')
+    config.commit()
+
+    assert Config.get(config.pk) == config
+    assert (cache.hits, cache.misses) == (1, 0)
+
+    config.name = 'b'
+    config.commit()
+    assert Config.get(config.pk).name == 'b'
+
+    config.delete()
+    assert Config.get(config.pk) is None
+    assert cache.misses == 1
+
+
+class SettingsTempl(Document):
+    options = DictField()
+
+    class Meta:
+        cache = LRUCache()
+
+
+def test_document_cache_copies(instance):
+    Settings = instance.register(SettingsTempl)
+    settings = Settings(options={'n': {'k': 1}})
+    settings.commit()
+    settings.options['n']['k'] = 2
+
+    loaded = Settings.get(settings.pk)
+    assert loaded.options == {'n': {'k': 1}}
+    loaded.options['n']['k'] = 99
+    assert Settings.get(settings.pk).options == {'n': {'k': 1}}
+    assert Settings.opts.cache.hits == 2
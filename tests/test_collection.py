@@ -1,4 +1,7 @@
-from udatastore.helpers import CollectionAbstraction, DataStoreClientWrapper
+from concurrent.futures import ThreadPoolExecutor
+
+from udatastore import helpers
+from udatastore.helpers import CollectionAbstraction, DataStoreClientWrapper, BatchError
 import pytest
 from google.cloud import datastore
 
@@ -76,6 +79,24 @@ def test_query(collection):
 def test_query(collection, filter, expected):
     retrieved = list(collection.query(filter))
     assert len(retrieved) == expected
+    assert collection.count(filter) == expected
+
+
+def test_count_in_deduplicates(collection):
+    collection.put({'tags': ['a', 'b']})
+    collection.put({'tags': ['b']})
+    collection.put({'tags': ['c']})
+    assert collection.count({'tags': {'$in': ['a', 'b']}}) == 2
+    assert collection.count({}) == 3
+
+
+def test_count_in_bounded_threads(collection, monkeypatch):
+    collection.put_multi([{'rank': i} for i in range(20)])
+    pools = []
+    monkeypatch.setattr(helpers, 'ThreadPoolExecutor',
+                        lambda max_workers: pools.append(max_workers) or ThreadPoolExecutor(max_workers))
+    assert collection.count({'rank': {'$in': list(range(30))}}) == 20
+    assert pools == [CollectionAbstraction.MERGE_WORKERS]
 
 
 def test_put_delete_multi(collection):
@@ -99,4 +120,53 @@ def test_put_multi_overload(collection):
     pks = collection.put_multi(data)
     assert len(list(collection.query({}))) == 1100
     retrieved = collection.get_multi([k.id for k in pks])
-    assert len(retrieved) == 1100
\ No newline at end of file
+    assert len(retrieved) == 1100
+
+def test_put_get_delete_multi_workers(client):
+    collection = DataStoreClientWrapper(client, workers=4)['User']
+    data = [{'a': i} for i in range(1200)]
+    pks = collection.put_multi(data, size=100)
+    assert len(set(pks)) == 1200
+    retrieved = collection.get_multi(pks, size=100)
+    assert [r['a'] for r in retrieved] == list(range(1200))
+    collection.delete_multi(pks, size=100, workers=2)
+    assert collection.count({}) == 0
+
+
+def test_put_multi_failing_chunk(collection):
+    data = [{'a': 1}, {'a': 2, '_id': 'b'}]
+    chunks = [[collection._pack(dict(d))] for d in data]
+
+    def put_multi(chunk):
+        if chunk[0].key.name == 'b':
+            raise ValueError('failed')
+        return chunk
+
+    with pytest.raises(BatchError) as excinfo:
+        list(collection._dispatch(put_multi, chunks, workers=2))
+    assert len(excinfo.value.failures) == 1
+    assert excinfo.value.failures[0][0] is chunks[1]
+
+
+def test_put_stream(collection):
+    payloads = ({'a': i} for i in range(25))
+    offsets = []
+    for offset, keys in collection.put_stream(payloads, size=10):
+        offsets.append((offset, len(keys)))
+    assert offsets == [(0, 10), (10, 10), (20, 5)]
+    assert collection.count({}) == 25
+
+
+@pytest.mark.usefixtures("data")
+def test_query_in_merged(collection):
+    retrieved = list(collection.query({'category': {'$in': ['A', 'B']}}, order=['-property']))
+    assert [r['property'] for r in retrieved] == [4.22, 2.8, 2.0, 0.0, 0.0, 0.0]
+    retrieved = list(collection.query({'category': {'$in': ['A', 'B']}}, order=['identifier'], limit=3))
+    assert [r['identifier'] for r in retrieved] == [5, 6, 7]
+
+
+def test_query_in_deduplicates(collection):
+    collection.put({'tags': ['a', 'b'], 'rank': 2})
+    collection.put({'tags': ['b'], 'rank': 1})
+    retrieved = list(collection.query({'tags': {'$in': ['a', 'b']}}, order=['rank']))
+    assert [r['rank'] for r in retrieved] == [1, 2]
@@ -1,5 +1,6 @@
-from udatastore.fields import DictField
+from udatastore.fields import BytesField, DictField
 from umongo import Document, fields, EmbeddedDocument
+from udatastore.data_proxy import Deferred
 
 
 class NormalizerTempl(EmbeddedDocument):
@@ -37,4 +38,193 @@ def test_store_retrieve(instance):
     found = list(Model.find({'normalization.scale': 1, 'hypers.variance': 0.2}))
     assert found[0] == m
     assert isinstance(found[0].normalization, Normalizer)
-    assert isinstance(found[0].normalization, NormalizerExt)
\ No newline at end of file
+    assert isinstance(found[0].normalization, NormalizerExt)
+
+class PageTempl(EmbeddedDocument):
+    title = fields.StringField()
+    body = fields.StringField(indexed=False)
+
+
+class ArchiveTempl(Document):
+    name = fields.StringField()
+    notes = fields.StringField()
+    blob = BytesField()
+    cover = fields.EmbeddedField(PageTempl)
+    pages = fields.ListField(fields.EmbeddedField(PageTempl))
+
+    class Meta:
+        unindexed = ('notes', 'cover.title')
+
+
+def test_unindexed(instance, client):
+    Page = instance.register(PageTempl)
+    Archive = instance.register(ArchiveTempl)
+    assert Archive.excluded_properties() == {'notes', 'blob', 'cover.title', 'cover.body', 'pages.body'}
+
+    a = Archive(name='x', notes='y', blob=[1, 2], cover=Page(title='a', body='b'),
+                pages=[Page(title='c', body='d'), Page(title='e', body='f')])
+    a.commit()
+    entity = client.get(a.pk)
+    assert set(entity.exclude_from_indexes) == {'notes', 'blob'}
+    assert set(entity['cover'].exclude_from_indexes) == {'title', 'body'}
+    assert [set(p.exclude_from_indexes) for p in entity['pages']] == [{'body'}, {'body'}]
+    assert Archive.find_one({'name': 'x'}).pages[1].body == 'f'
+
+
+class LazyArchiveTempl(Document):
+    name = fields.StringField()
+    blob = BytesField()
+    cover = fields.EmbeddedField(PageTempl)
+    pages = fields.ListField(fields.EmbeddedField(PageTempl))
+    tags = DictField()
+
+    class Meta:
+        lazy = True
+
+
+def test_lazy(instance):
+    Page = instance.register(PageTempl)
+    LazyArchive = instance.register(LazyArchiveTempl)
+    a = LazyArchive(name='x', blob={'a': 1}, cover=Page(title='a', body='b'), pages=[Page(title='c')],
+                    tags={'k.1': 'v'})
+    a.commit()
+
+    found = LazyArchive.get(a.pk)
+    assert isinstance(found._data._data['blob'], Deferred)
+    assert found.name == 'x'
+    assert found.blob == {'a': 1}
+    assert not isinstance(found._data._data['blob'], Deferred)
+    assert isinstance(found._data._data['cover'], Deferred)
+    assert found.dump() == a.dump()
+
+    # Unconverted values are written back as they were stored
+    found = LazyArchive.get(a.pk)
+    found.name = 'y'
+    found.commit()
+    found = next(LazyArchive.find({'name': 'y'}, lazy=False))
+    assert not isinstance(found._data._data['cover'], Deferred)
+    assert found.cover.title == 'a' and found.pages[0].title == 'c' and found.tags == {'k.1': 'v'}
+
+    instance.register(NormalizerTempl)
+    Model = instance.register(ModelTempl)
+    Model(hypers={'a.b': 1}).commit()
+    found = next(Model.find({}, lazy=True))
+    assert isinstance(found._data._data['hypers'], Deferred)
+    assert found.hypers == {'a.b': 1}
+
+
+constructed = []
+
+
+class MemoTempl(Document):
+    title = fields.StringField()
+    tags = DictField()
+
+    def __init__(self, **kwargs):
+        super(type(self), self).__init__(**kwargs)
+        constructed.append(kwargs)
+        self.title = self.title or 'untitled'
+
+
+def test_lazy_custom_init(instance):
+    Memo = instance.register(MemoTempl)
+    Memo(title='memo', tags={'a': 1}).commit()
+
+    # The constructor runs, the loaded values replace the ones it set
+    found = next(Memo.find({}, lazy=True))
+    assert len(constructed) == 2
+    assert isinstance(found._data._data['tags'], Deferred)
+    assert found.title == 'memo' and found.tags == {'a': 1}
+    found = Memo.get(found.pk)
+    assert not isinstance(found._data._data['tags'], Deferred)
+    assert not found.is_modified()
+
+
+validated = []
+
+
+class JournalTempl(Document):
+    title = fields.StringField(io_validate=lambda field, value: validated.append(value))
+    meta = DictField(io_validate=lambda field, value: validated.append(dict(value)))
+    cover = fields.EmbeddedField(PageTempl)
+    pages = fields.ListField(fields.EmbeddedField(PageTempl))
+
+
+def test_modified_fields(instance):
+    Page = instance.register(PageTempl)
+    Journal = instance.register(JournalTempl)
+    j = Journal(title='a', meta={'x.y': 1}, cover=Page(title='c'), pages=[Page(title='p')])
+    j.commit()
+    assert len(validated) == 2
+
+    found = Journal.get(j.pk)
+    stored = found._data.to_mongo()
+    found.title = 'b'
+    assert found._data.get_modified_fields() == ['title']
+    payload = found._data.to_mongo()
+    assert all(payload[name] is stored[name] for name in ('meta', 'cover', 'pages'))
+    found.commit()
+    assert validated[2:] == ['b']
+
+    # Modifications in place are detected
+    found.meta['z'] = 2
+    found.pages[0].title = 'q'
+    assert set(found._data.get_modified_fields()) == {'meta', 'pages'}
+    payload = found._data.to_mongo()
+    assert payload['cover'] is stored['cover'] and payload['pages'] is not stored['pages']
+    found.commit()
+    assert validated[3:] == [{'x.y': 1, 'z': 2}]
+    found = Journal.get(j.pk)
+    assert found.pages[0].title == 'q' and found.meta == {'x.y': 1, 'z': 2}
+
+
+class ShelfTempl(Document):
+    name = fields.StringField()
+    nums = fields.ListField(fields.IntegerField())
+
+
+class NotesTempl(EmbeddedDocument):
+    lines = fields.ListField(fields.StringField())
+
+
+class BoardTempl(Document):
+    notes = fields.EmbeddedField(NotesTempl)
+
+
+def test_modified_lists(instance):
+    Shelf = instance.register(ShelfTempl)
+    s = Shelf(name='a', nums=[1, 2, 3])
+    s.commit()
+
+    for lazy in (False, True):
+        found = next(Shelf.find({'name': s.name}, lazy=lazy))
+        found.nums.insert(0, 0)
+        del found.nums[-1]
+        found.name = 'b' if lazy else 'c'
+        found.commit()
+        s = Shelf.get(s.pk)
+        assert s.nums == ([0, 0, 1] if lazy else [0, 1, 2])
+
+    # Lists assigned or defaulted before the previous commit are tracked as well
+    s.nums += [5]
+    s.nums *= 2
+    s.commit()
+    s.nums.insert(0, 4)
+    s.commit()
+    assert Shelf.get(s.pk).nums == [4, 0, 0, 1, 5, 0, 0, 1, 5]
+    empty = Shelf(name='e')
+    empty.commit()
+    empty.nums.append(1)
+    empty.commit()
+    del empty.nums[:]
+    empty.commit()
+    assert Shelf.get(empty.pk).nums == []
+
+    instance.register(NotesTempl)
+    Board = instance.register(BoardTempl)
+    b = Board(notes={'lines': ['x', 'y']})
+    b.commit()
+    found = Board.get(b.pk)
+    del found.notes.lines[0]
+    found.commit()
+    assert Board.get(b.pk).notes.lines == ['y']
@@ -0,0 +1,65 @@
+from umongo import Document, fields
+import pytest
+
+from udatastore import DataStoreInstance
+from udatastore.instrumentation import InMemoryCollector, LATENCY_BUCKETS
+
+
+class GaugeTempl(Document):
+    name = fields.StringField()
+    tags = fields.ListField(fields.StringField())
+
+
+@pytest.fixture
+def collector():
+    return InMemoryCollector()
+
+
+@pytest.fixture
+def Gauge(client, collector):
+    inst = DataStoreInstance()
+    inst.init(client, instrumentation=collector)
+    return inst.register(GaugeTempl)
+
+
+def test_collector():
+    collector = InMemoryCollector()
+    collector.rpc('Kind', 'get', 10, 0.003)
+    collector.rpc('Kind', 'get', 30, 10.0)
+    collector.fan_out('Kind', 3)
+    collector.query_results('Kind', 12, 9)
+
+    stats = collector.stats('Kind', 'get')
+    assert stats.rpcs == 2
+    assert stats.entities_per_rpc == 20
+    assert stats.latencies[LATENCY_BUCKETS.index(0.005)] == 1
+    assert stats.latencies[-1] == 1
+    query = collector.report()['Kind', 'query']
+    assert query['fan_out_factor'] == 3
+    assert (query['read'], query['yielded']) == (12, 9)
+
+    collector.reset()
+    assert collector.report() == {}
+
+
+def test_instrumented_operations(Gauge, collector):
+    gauges = [Gauge(name=str(i), tags=['a', 'b'] if i % 2 else ['a']) for i in range(5)]
+    Gauge.commit_multi(gauges)
+    put = collector.stats('GaugeTempl', 'put')
+    assert (put.rpcs, put.entities, put.serialized) == (1, 5, 5)
+    assert collector.stats('GaugeTempl', 'commit').serialized == 5
+
+    assert len(Gauge.get_multi([g.pk for g in gauges])) == 5
+    get = collector.stats('GaugeTempl', 'get')
+    assert (get.rpcs, get.entities, get.serialized) == (1, 5, 5)
+
+    # Odd gauges match both queries of the fan out, and are read twice
+    assert len(list(Gauge.find({'tags': {'$in': ['a', 'b']}}))) == 5
+    query = collector.stats('GaugeTempl', 'query')
+    assert query.fan_out_factor == 2
+    assert (query.read, query.yielded) == (7, 5)
+    assert query.entities == 7
+    assert collector.stats('GaugeTempl', 'find').serialized == 5
+
+    Gauge.delete_multi(gauges)
+    assert collector.stats('GaugeTempl', 'delete').entities == 5
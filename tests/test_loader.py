@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from umongo import Document, fields
+import pytest
+
+from udatastore import DataStoreInstance
+from udatastore.fields import DictField
+from udatastore.loader import DataLoader
+
+
+class GadgetTempl(Document):
+    name = fields.StringField()
+    labels = DictField()
+
+
+class WidgetTempl(Document):
+    name = fields.StringField()
+    gadget = fields.ReferenceField(GadgetTempl)
+
+
+@pytest.fixture
+def loader_instance(client):
+    inst = DataStoreInstance()
+    inst.init(client, loader=DataLoader(window=0.05, max_batch=4))
+    return inst
+
+
+def test_loader_coalesces(loader_instance, client, monkeypatch):
+    Gadget = loader_instance.register(GadgetTempl)
+    gadgets = [Gadget(name=str(i), labels={'nested': {'i': i}}) for i in range(6)]
+    Gadget.commit_multi(gadgets)
+
+    get_multi = client.get_multi
+    calls = []
+
+    def counting(keys, *args, **kwargs):
+        calls.append(len(keys))
+        return get_multi(keys, *args, **kwargs)
+
+    monkeypatch.setattr(client, 'get_multi', counting)
+    pks = [gadgets[0].pk, gadgets[0].pk, gadgets[1].pk, 'missing']
+    with ThreadPoolExecutor(len(pks)) as executor:
+        loaded = list(executor.map(Gadget.get, pks))
+    assert calls == [3]
+    assert [d.name if d else None for d in loaded] == ['0', '0', '1', None]
+    assert loaded[0] is not loaded[1]
+    loaded[0].labels['nested']['i'] = 10
+    assert loaded[1].labels['nested']['i'] == 0
+
+    # A full batch is sent right away, without waiting for the window
+    calls.clear()
+    pks = [g.pk for g in gadgets]
+    with ThreadPoolExecutor(len(pks)) as executor:
+        loaded = list(executor.map(Gadget.get, pks))
+    assert [d.name for d in loaded] == [g.name for g in gadgets]
+    assert sorted(calls) == [2, 4]
+
+
+def test_loader_references(loader_instance, client, monkeypatch):
+    Gadget = loader_instance.register(GadgetTempl)
+    Widget = loader_instance.register(WidgetTempl)
+    gadget = Gadget(name='g')
+    gadget.commit()
+    widgets = [Widget(name=str(i), gadget=gadget) for i in range(3)]
+    Widget.commit_multi(widgets)
+    widgets = list(Widget.find())
+
+    get_multi = client.get_multi
+    calls = []
+    monkeypatch.setattr(client, 'get_multi', lambda keys, *a, **kw: calls.append(keys) or get_multi(keys, *a, **kw))
+    with ThreadPoolExecutor(len(widgets)) as executor:
+        fetched = list(executor.map(lambda w: w.gadget.fetch(), widgets))
+    assert [g.name for g in fetched] == ['g'] * 3
+    assert len(calls) == 1
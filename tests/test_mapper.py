@@ -0,0 +1,58 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+
+from umongo import Document, fields
+import pytest
+
+from udatastore.mapper import MapError
+
+
+class ReadingTempl(Document):
+    sensor = fields.StringField(required=True)
+    value = fields.IntegerField()
+
+
+def _double(reading):
+    if reading.value == 3:
+        raise ValueError('faulty sensor')
+    if reading.value % 2:
+        reading.value *= 2
+
+
+def test_map(instance):
+    Reading = instance.register(ReadingTempl)
+    readings = [Reading(sensor='a' if i < 8 else 'b', value=i) for i in range(10)]
+    Reading.commit_multi(readings)
+
+    reports, initialized = [], []
+    with ThreadPoolExecutor(2) as executor:
+        report = Reading.map(_double, {'sensor': 'a'}, workers=2, chunk_size=3, executor=executor,
+                             initializer=lambda: initialized.append(True),
+                             progress=lambda r: reports.append(r.processed))
+    assert initialized == [True]
+    assert (report.processed, report.written, report.missing) == (8, 3, 0)
+    assert report.failed == [readings[3].pk]
+    assert [(keys, str(exc)) for keys, exc in report.errors] == [([readings[3].pk], 'faulty sensor')]
+    assert report.throughput > 0
+    assert len(reports) == 3 and reports[-1] == 8
+    assert sorted(r.value for r in Reading.find()) == [0, 2, 2, 3, 4, 6, 8, 9, 10, 14]
+
+
+@pytest.mark.skipif(os.environ.get('UDATASTORE_TEST_CLIENT') == 'memory',
+                    reason='writes of the forked workers are not visible to an in-memory client')
+def test_map_processes(instance):
+    Reading = instance.register(ReadingTempl)
+    Reading.commit_multi([Reading(sensor='a', value=i) for i in range(6)])
+    report = Reading.map(_double, workers=2, chunk_size=2)
+    assert (report.processed, report.written, len(report.failed)) == (6, 2, 1)
+    assert sorted(r.value for r in Reading.find()) == [0, 2, 2, 3, 4, 10]
+
+
+def test_map_started_workers(instance):
+    Reading = instance.register(ReadingTempl)
+    Reading.commit_multi([Reading(sensor='a', value=i) for i in range(2)])
+    with ProcessPoolExecutor(1) as executor:
+        # Start the worker before map is called
+        executor.submit(os.getpid).result()
+        with pytest.raises(MapError):
+            Reading.map(_double, executor=executor)
@@ -0,0 +1,42 @@
+from google.cloud import datastore
+
+from udatastore.memory import MemoryClient
+
+
+def _put(client, **properties):
+    entity = datastore.Entity(key=client.key('Item'))
+    entity.update(properties)
+    client.put(entity)
+    return entity.key
+
+
+def test_put_get_delete():
+    client = MemoryClient()
+    key = _put(client, a=1)
+    assert not key.is_partial
+    assert client.get(key) == {'a': 1}
+    client.delete(key)
+    assert client.get(key) is None
+    assert client.rpc_count == 4
+
+
+def test_query_cursor():
+    client = MemoryClient(batch_size=2)
+    for i in range(5):
+        _put(client, rank=i, tags=['even' if i % 2 == 0 else 'odd'])
+    query = client.query(kind='Item', order=['-rank'])
+    query.add_filter('tags', '=', 'even')
+    iterator = query.fetch(limit=2)
+    assert [e['rank'] for e in iterator] == [4, 2]
+    assert [e['rank'] for e in query.fetch(start_cursor=iterator.next_page_token)] == [0]
+
+
+def test_transaction():
+    client = MemoryClient()
+    entity = datastore.Entity(key=client.key('Item'))
+    entity['a'] = 1
+    with client.transaction():
+        client.put(entity)
+        assert client.current_transaction is not None
+        assert entity.key.is_partial
+    assert client.get(entity.key) == {'a': 1}
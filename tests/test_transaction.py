@@ -0,0 +1,107 @@
+from google.api_core import exceptions
+from umongo import Document, fields
+from umongo.exceptions import ValidationError
+import pytest
+
+
+class AccountTempl(Document):
+    owner = fields.StringField(required=True)
+    balance = fields.IntegerField()
+
+
+def test_transaction_batches_writes(instance):
+    Account = instance.register(AccountTempl)
+    old = Account(owner='old', balance=0)
+    old.commit()
+
+    with instance.transaction() as transaction:
+        accounts = [Account(owner=owner, balance=10) for owner in 'abc']
+        Account.commit_multi(accounts[:2])
+        accounts[2].commit()
+        old.delete()
+        assert Account.count() == 1
+        assert not accounts[0].is_created
+
+    assert all(a.is_created for a in accounts)
+    assert sorted(a.owner for a in Account.find()) == ['a', 'b', 'c']
+    assert Account.get(accounts[2].pk).balance == 10
+    assert not old.is_created
+    assert [attempt.error for attempt in transaction.attempts] == [None]
+
+
+def test_transaction_retries(instance, client, monkeypatch):
+    Account = instance.register(AccountTempl)
+    put_multi = client.put_multi
+    calls = []
+
+    def flaky(entities):
+        calls.append(entities)
+        if len(calls) < 3:
+            raise exceptions.Aborted('too much contention')
+        return put_multi(entities)
+
+    monkeypatch.setattr(client, 'put_multi', flaky)
+    with instance.transaction(initial_delay=0.001) as transaction:
+        account = Account(owner='a')
+        account.commit()
+    assert [type(attempt.error) for attempt in transaction.attempts] == [exceptions.Aborted] * 2 + [type(None)]
+    assert all(attempt.delay is not None for attempt in transaction.attempts[:2])
+    assert account.is_created
+    assert Account.count() == 1
+
+
+def test_transaction_retries_committed(instance, client, monkeypatch):
+    Account = instance.register(AccountTempl)
+    client_transaction = client.transaction
+    failures = [exceptions.DeadlineExceeded('committed, but the response was lost')]
+
+    class LostResponse:
+        def __init__(self):
+            self.transaction = client_transaction()
+
+        def __enter__(self):
+            return self.transaction.__enter__()
+
+        def __exit__(self, *exc_info):
+            self.transaction.__exit__(*exc_info)
+            if failures:
+                raise failures.pop()
+
+    monkeypatch.setattr(client, 'transaction', LostResponse)
+    allocate_ids = client.allocate_ids
+    allocated = []
+    monkeypatch.setattr(client, 'allocate_ids', lambda key, n: allocated.append(n) or allocate_ids(key, n))
+    with instance.transaction(initial_delay=0.001) as transaction:
+        accounts = [Account(owner=owner) for owner in 'ab']
+        Account.commit_multi(accounts)
+    assert len(transaction.attempts) == 2
+    assert allocated == [2]
+    assert Account.count() == 2
+    assert sorted(a.owner for a in Account.find()) == ['a', 'b']
+
+
+def test_transaction_errors(instance, client, monkeypatch):
+    Account = instance.register(AccountTempl)
+
+    # Invalid documents are not retried, nothing is attempted
+    with pytest.raises(ValidationError):
+        with instance.transaction() as transaction:
+            Account(balance=1).commit()
+    assert transaction.attempts == []
+
+    def failing(entities):
+        raise exceptions.InvalidArgument('bad request')
+
+    monkeypatch.setattr(client, 'put_multi', failing)
+    with pytest.raises(exceptions.InvalidArgument):
+        with instance.transaction(initial_delay=0.001) as transaction:
+            Account(owner='a').commit()
+    assert len(transaction.attempts) == 1
+
+    # Nothing is written when the block fails
+    monkeypatch.undo()
+    with pytest.raises(RuntimeError):
+        with instance.transaction():
+            Account(owner='b').commit()
+            raise RuntimeError()
+    assert Account.count() == 0
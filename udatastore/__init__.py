@@ -16,5 +16,6 @@ import umongo
 
 from .instance import DataStoreInstance, DataStoreBuilder
 from .helpers import DataStoreClientWrapper
+from .reference import prefetch
 
 umongo.frameworks.register_builder(DataStoreBuilder)
@@ -0,0 +1,87 @@
+# Copyright 2019 ML2Grow NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import collections
+from functools import partial
+
+
+def run_in_executor(instance, func, *args, **kwargs):
+    """
+    Run a blocking call in the executor of the instance, returns an awaitable.
+    """
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(instance.executor, partial(func, *args, **kwargs))
+
+
+def _fetch_page(cursor):
+    try:
+        return cursor.next_page(), cursor.next_cursor
+    except StopIteration:
+        return None
+
+
+class AsyncDocumentCursor:
+    """
+    Asynchronous iterator over a DocumentCursor.
+
+    Pages are fetched in the executor of the instance, the next page is requested
+    as soon as the current one is handed out. next_cursor resumes the query after
+    the last page handed out, not after the prefetched one.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.next_cursor = None
+        self._current = collections.deque()
+        self._pending = None
+        self._exhausted = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._current:
+            page = await self.next_page()
+            if page is None:
+                raise StopAsyncIteration
+            self._current.extend(page)
+        return self._current.popleft()
+
+    async def next_page(self):
+        """
+        Return the documents of the next page, or None when exhausted.
+        """
+        if self._exhausted:
+            return None
+        if self._pending is None:
+            self._pending = self._fetch()
+        fetched = await self._pending
+        self._pending = None
+        if fetched is None:
+            self._exhausted = True
+            return None
+        page, self.next_cursor = fetched
+        self._pending = self._fetch()
+        return page
+
+    def _fetch(self):
+        return run_in_executor(self.cursor.document_cls.opts.instance, _fetch_page, self.cursor)
+
+
+async def gather_get_multi(*requests):
+    """
+    Run the get_multi of several (document_cls, pks) requests concurrently, returns their results in order.
+    """
+    return await asyncio.gather(*(document_cls.async_get_multi(pks) for document_cls, pks in requests))
@@ -0,0 +1,116 @@
+# Copyright 2019 ML2Grow NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import atexit
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer for Document.commit.
+
+    Enable it by passing a WriteBuffer to DataStoreInstance.init, commit then enqueues the document
+    and returns a Future resolving to the document once it is written. Pending documents are written
+    with one commit_multi per document class, in chunks of up to size entities:
+
+    - by a background thread, once size documents are pending or linger seconds after the oldest one
+    - on flush, which returns once everything committed before was written
+    - at process exit
+
+    Documents are validated and serialized when written, a document committed again while pending is
+    written once. Validation errors are delivered to the future of the faulting document, write errors
+    to the futures of the documents which were not written. Commits within a transaction or a
+    session deferring commits bypass the buffer.
+    """
+
+    def __init__(self, size=500, linger=0.05):
+        self.size = size
+        self.linger = linger
+        self._pending = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+
+    def add(self, doc, io_validate_all=False):
+        """ Enqueue a document, returns the Future of its write """
+        with self._condition:
+            if id(doc) in self._pending:
+                return self._pending[id(doc)][2]
+            future = Future()
+            self._pending[id(doc)] = doc, io_validate_all, future
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='udatastore-write-buffer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            if len(self._pending) >= self.size:
+                self._condition.notify()
+        return future
+
+    def flush(self):
+        """ Write the pending documents in the calling thread, waiting for a write in progress first """
+        with self._write_lock:
+            self._write(self._take())
+
+    def _take(self):
+        with self._condition:
+            entries = list(self._pending.values())
+            self._pending.clear()
+        return entries
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = time.monotonic() + self.linger
+                while len(self._pending) < self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            self.flush()
+
+    def _write(self, entries):
+        per_class = collections.OrderedDict()
+        for doc, io_validate_all, future in entries:
+            per_class.setdefault(type(doc), []).append((doc, io_validate_all, future))
+        for document_cls, cls_entries in per_class.items():
+            self._write_class(document_cls, cls_entries)
+
+    def _write_class(self, document_cls, entries):
+        # pylint: disable=W0212
+        prepared = []
+        futures = {}
+        for doc, io_validate_all, future in entries:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                doc_prepared = list(document_cls._prepare_commit([doc], io_validate_all))
+            except Exception as exc:  # pylint: disable=W0703
+                future.set_exception(exc)
+                continue
+            if not doc_prepared:
+                # Not modified, nothing to write
+                future.set_result(doc)
+                continue
+            prepared.extend(doc_prepared)
+            futures[id(doc)] = future
+        try:
+            for doc in document_cls._commit_prepared(prepared, size=self.size):
+                futures.pop(id(doc)).set_result(doc)
+        except Exception as exc:  # pylint: disable=W0703
+            for future in futures.values():
+                future.set_exception(exc)
@@ -17,8 +17,8 @@ import inspect
 from umongo import fields
 from umongo.frameworks.pymongo import _list_io_validate, _embedded_document_io_validate
 from umongo.builder import _build_document_opts as _build_document_opts_orig
-from umongo.fields import ListField, EmbeddedField
-from umongo.document import DocumentImplementation, DocumentOpts
+from umongo.fields import EmbeddedField
+from umongo.document import DocumentImplementation
 from umongo.builder import (
     BaseBuilder,
     Schema,
@@ -31,9 +31,10 @@ from umongo.builder import (
 
 from .data_proxy import data_proxy_factory
 from .helpers import DataStoreClientWrapper
-from .document import DataStoreDocument
+from .hydrator import compile_hydrator
+from .document import DataStoreDocument, DataStoreDocumentOpts
 from .reference import DataStoreReference
-from .fields import ReferenceField, SUPPORTED_FIELD_TYPES
+from .fields import BytesField, ListField, ReferenceField, TrackedList, SUPPORTED_FIELD_TYPES
 
 
 def _build_document_opts(instance, template, name, nmspc, bases):
@@ -41,7 +42,15 @@ def _build_document_opts(instance, template, name, nmspc, bases):
     components = opts.__dict__
     # Override camel_to_snake function
     components['collection_name'] = name
-    return DocumentOpts(**components)
+    # Datastore specific options, inherited from the parent documents
+    meta = nmspc.get('Meta')
+    inherited = [base.opts for base in bases if issubclass(base, DataStoreDocument)]
+    for option in ('cache', 'unindexed', 'lazy', 'parent'):
+        components[option] = getattr(meta, option, None)
+        for base_opts in inherited:
+            if components[option] is None:
+                components[option] = getattr(base_opts, option, None)
+    return DataStoreDocumentOpts(**components)
 
 
 class DataStoreBuilder(BaseBuilder):
@@ -53,6 +62,7 @@ class DataStoreBuilder(BaseBuilder):
         return isinstance(database, DataStoreClientWrapper)
 
     def _patch_field(self, field):
+        self._track_list_field(field)
         super()._patch_field(field)
 
         validators = field.io_validate
@@ -64,7 +74,7 @@ class DataStoreBuilder(BaseBuilder):
             else:
                 validators = [validators]
             field.io_validate = validators
-        if isinstance(field, ListField):
+        if isinstance(field, fields.ListField):
             field.io_validate_recursive = _list_io_validate
         if isinstance(field, fields.ReferenceField):
             # due to eventual consistency, this check is to prone to failure.
@@ -73,12 +83,24 @@ class DataStoreBuilder(BaseBuilder):
         if isinstance(field, EmbeddedField):
             field.io_validate_recursive = _embedded_document_io_validate
 
+    @staticmethod
+    def _track_list_field(field):
+        # Swap umongo.fields.ListField with our implementation, which notices all in place changes of the lists.
+        # Done in place, the fields of embedded documents are patched as well
+        if isinstance(field, fields.ListField) and not isinstance(field, ListField):
+            field.__class__ = ListField
+            missing = field.missing
+            if callable(missing):
+                field.missing = lambda: TrackedList(field.container, missing())
+
     @classmethod
     def _convert_reference_field(cls, field):
         # Swap referencefield with our implementation for datastore keys
         if isinstance(field, fields.ReferenceField):
+            metadata = field.metadata
             field = ReferenceField(**field.__dict__)
-        if isinstance(field, ListField):
+            field.metadata = metadata
+        if isinstance(field, fields.ListField):
             field.container = cls._convert_reference_field(field.container)
         return field
 
@@ -86,7 +108,7 @@ class DataStoreBuilder(BaseBuilder):
     def _check_field(cls, field):
         if field.__class__ not in SUPPORTED_FIELD_TYPES:
             raise Exception("Field type {0} is currently unsupported for datastore".format(field.__class__.__name__))
-        if isinstance(field, ListField):
+        if isinstance(field, fields.ListField):
             field.container = cls._check_field(field.container)
         return field
 
@@ -100,7 +122,8 @@ class DataStoreBuilder(BaseBuilder):
     def build_document_from_template(self, template):
         """
         Lots of copy paste, only to sneak in _apply_to_schema which converts ReferenceFields to our
-        ReferenceFields, and checks valid fields are used.
+        ReferenceFields, and checks valid fields are used. The entity hydrator is compiled once the
+        implementation exists.
         """
         assert issubclass(template, DocumentTemplate)
         name = template.__name__
@@ -128,6 +151,9 @@ class DataStoreBuilder(BaseBuilder):
         nmspc['Schema'] = schema_cls
         schema = schema_cls()
         nmspc['schema'] = schema
+        for field in schema.fields.values():
+            if isinstance(field, BytesField) and field.shard_size:
+                field.shard_cache = opts.cache
         nmspc['DataProxy'] = data_proxy_factory(name, schema, strict=opts.strict)
 
         # _build_document_opts cannot determine the indexes given we need to
@@ -135,6 +161,7 @@ class DataStoreBuilder(BaseBuilder):
         opts.indexes = _collect_indexes(nmspc.get('Meta'), schema.fields, bases)
 
         implementation = type(name, bases, nmspc)
+        implementation.hydrate = staticmethod(compile_hydrator(implementation))
         self._templates_lookup[template] = implementation
         # Notify the parent & grand parents of the newborn !
         for base in bases:
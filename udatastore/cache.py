@@ -0,0 +1,109 @@
+# Copyright 2019 ML2Grow NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import copy
+import threading
+import time
+
+
+class BaseCache:
+    """
+    Interface of the entity caches used by CollectionAbstraction, keyed on datastore.Key.
+
+    Implementations provide _get_multi, set_multi, delete_multi and clear, the base class
+    keeps the hit and miss counters. The entities given to set_multi and returned by get_multi are
+    handed to documents which may modify them, implementations must not share them with each other.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get_multi(self, keys):
+        """
+        Return a dict mapping the cached keys among keys on their entity.
+        """
+        found = self._get_multi(keys)
+        with self._stats_lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def _get_multi(self, keys):
+        raise NotImplementedError
+
+    def set_multi(self, entities):
+        raise NotImplementedError
+
+    def delete_multi(self, keys):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUCache(BaseCache):
+    """
+    In-process cache holding up to max_size entities, evicting the least recently used ones.
+    With a ttl (in seconds), entities also expire that long after they were stored.
+    Entities are copied when stored and when returned.
+    """
+
+    def __init__(self, max_size=1000, ttl=None, timer=time.monotonic):
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self._timer = timer
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get_multi(self, keys):
+        now = self._timer()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                entity, expires = entry
+                if expires is not None and expires <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entity
+        return {key: copy.deepcopy(entity) for key, entity in found.items()}
+
+    def set_multi(self, entities):
+        expires = None if self.ttl is None else self._timer() + self.ttl
+        entities = [copy.deepcopy(entity) for entity in entities]
+        with self._lock:
+            for entity in entities:
+                self._entries[entity.key] = (entity, expires)
+                self._entries.move_to_end(entity.key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete_multi(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,84 @@
+# Copyright 2019 ML2Grow NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from .reference import prefetch as prefetch_references
+
+
+class DocumentCursor:  # pylint: disable=R0902
+    """
+    Iterator over the documents returned by find.
+
+    Documents (or keys, for keys only queries) are built one page at a time. next_cursor holds
+    the cursor resuming the query after the last fetched page, or None once the query is exhausted.
+    """
+
+    def __init__(self, document_cls, pages, prefetch=(), keys_only=False, partial=False, lazy=None):
+        # pages yield (entities, cursor) tuples, see CollectionAbstraction.query_pages
+        # pylint: disable=R0913
+        self.document_cls = document_cls
+        self.next_cursor = None
+        self._pages = iter(pages)
+        self._prefetch = prefetch
+        self._keys_only = keys_only
+        self._partial = partial
+        self._lazy = lazy
+        self._current = iter(())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            for doc in self._current:
+                return doc
+            self._current = iter(self.next_page())
+
+    def next_page(self):
+        """
+        Fetch the next page and return its documents, raises StopIteration when exhausted.
+        """
+        entities, self.next_cursor = next(self._pages)
+        if self._keys_only:
+            return [entity.key for entity in entities]
+        opts = self.document_cls.opts
+        session = opts.instance.current_session
+        instrumentation = opts.instance.db.instrumentation
+        start = time.perf_counter() if instrumentation.enabled else None
+        docs = [self._build(entity, session) for entity in entities]
+        if start is not None:
+            instrumentation.serialization(opts.collection_name, 'find', len(docs), time.perf_counter() - start)
+        if self._prefetch:
+            prefetch_references(docs, *self._prefetch)
+        return docs
+
+    def _build(self, entity, session):
+        if session is None:
+            return self.document_cls.build_from_entity(entity, partial=self._partial, lazy=self._lazy)
+        doc = session.get(entity.key)
+        if doc is None:
+            doc = self.document_cls.build_from_entity(entity, partial=self._partial, lazy=self._lazy)
+            doc = session.register(doc)
+        return doc
+
+    def pages(self):
+        """
+        Iterate the remaining results page by page.
+        """
+        while True:
+            try:
+                yield self.next_page()
+            except StopIteration:
+                return
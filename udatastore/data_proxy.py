@@ -1,51 +1,217 @@
+from collections.abc import Mapping
+
+from marshmallow import ValidationError, missing
+from umongo.abstract import BaseDataObject
 from umongo.data_proxy import BaseDataProxy, BaseNonStrictDataProxy
+from umongo.fields import EmbeddedField, ListField
+from umongo.i18n import gettext as _
 from google.cloud import datastore
 
+from .fields import BytesField, DictField, ReferenceField
+from .shards import Shards, stale_keys
+
+
+class _KeyTranslatingView(Mapping):
+    """
+    Read-only view on the data of a DataProxy, returning the id or name of the keys stored in key-capable fields
+    Lets the schema dump the data without copying or mutating it
+    """
+    __slots__ = ('_data', '_key_fields')
+
+    def __init__(self, data, key_fields):
+        self._data = data
+        self._key_fields = key_fields
+
+    def __getitem__(self, name):
+        value = self._data[name]
+        if name in self._key_fields and isinstance(value, datastore.Key):
+            return value.id_or_name
+        return value
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Deferred:
+    """
+    Stored value of a field in a lazily hydrated DataProxy, converted on first access
+    """
+    __slots__ = ('convert', 'value')
+
+    def __init__(self, convert, value):
+        self.convert = convert
+        self.value = value
+
+    def __repr__(self):
+        return '<Deferred {0!r}>'.format(self.value)
+
+
+def _is_modified(value):
+    return isinstance(value, BaseDataObject) and value.is_modified()
 
-class KeyTranslatingBaseDataProxy(BaseDataProxy):
+
+_IMMUTABLE_TYPES = (bytes, str, int, float, complex, type(None))
+
+
+def _is_immutable(value):
+    """ Whether a value can't have been modified in place since it was loaded """
+    if isinstance(value, (tuple, frozenset)):
+        return all(map(_is_immutable, value))
+    return isinstance(value, _IMMUTABLE_TYPES + (Deferred, Shards))
+
+
+class KeyTranslatingMixin:
     """
     Handles converting fields stored as datastore.Key (because attribute='_id' was set) back to their value
     Only for retrieving data, wrapping the keys here is difficult (the other key attributes are unknown in
     the DataProxy)
+
+    Also remembers the stored value of the fields which are expensive to encode, these are reused by to_mongo
+    as long as the field is not modified, also in place for lists, dicts and embedded documents. Deferred and
+    sharded values are resolved when accessed. In place changes of the values of BytesFields (opaque fields)
+    go unnoticed, their stored value is only reused for immutable values or if the field allows it.
     """
-    # pylint: disable=W0201
+    __slots__ = ()
+    _key_fields = frozenset()
+    _encoded_fields = frozenset()
+    _opaque_fields = frozenset()
+    _sharded_fields = {}
+
+    def __init__(self, data=None):
+        # _encoded is a slot of the concrete DataProxy classes below
+        self._encoded = {}  # pylint: disable=E0237
+        super().__init__(data)
+
+    def load(self, data, partial=False):
+        self._encoded = {}  # pylint: disable=E0237
+        super().load(data, partial=partial)
+
+    def from_mongo(self, data, partial=False):
+        super().from_mongo(data, partial=partial)
+        self.remember_encoded(data)
+
+    def remember_encoded(self, data):
+        """ Keep the stored values of the expensive fields, data being the stored representation """
+        self._encoded = {name: data[name] for name in self._encoded_fields if name in data}  # pylint: disable=E0237
+
+    def stale_shards(self, key, payload):
+        """
+        Keys of the shards of the remembered values of the sharded fields which are not part of payload, the
+        packed representation about to be written for key. These are left over when a value shrinks.
+        """
+        return [shard_key for name in self._sharded_fields
+                for shard_key in stale_keys(key, name, self._encoded.get(name), payload.get(name))]
+
+    def _to_mongo(self):
+        mongo_data = {}
+        encoded = self._encoded
+        modified = self._modified_data
+        opaque = self._opaque_fields
+        for name, value in self._data.items():
+            if name in encoded and name not in modified and not _is_modified(value) and \
+                    (name not in opaque or _is_immutable(value)):
+                mongo_data[name] = encoded[name]
+                continue
+            if isinstance(value, Deferred):
+                mongo_data[name] = value.value
+                continue
+            value = self._fields_from_mongo_key[name].serialize_to_mongo(value)
+            if value is not missing:
+                mongo_data[name] = value
+        return mongo_data
+
     def dump(self):
-        data_old = self._data
-        self._data = {}
-        for key, value in data_old.items():
-            if isinstance(value, datastore.Key):
-                value = value.id_or_name
-            self._data[key] = value
-        result = super().dump()
-        self._data = data_old
-        return result
+        self.resolve()
+        data, err = self.schema.dump(_KeyTranslatingView(self._data, self._key_fields))
+        if err:
+            raise ValidationError(err)
+        return data
 
     def get(self, name, to_raise=KeyError):
         value = super().get(name, to_raise)
         if isinstance(value, datastore.Key):
             value = value.id_or_name
+        elif isinstance(value, (Deferred, Shards)):
+            value = self._resolve(self._get_field(name, to_raise)[0])
         return value
 
+    def get_by_mongo_name(self, name):
+        self._resolve(name)
+        return super().get_by_mongo_name(name)
 
-class KeyTranslatingBaseNonStrictDataProxy(BaseNonStrictDataProxy):
-    # pylint: disable=W0201
-    def dump(self):
-        data_old = self._data
-        self._data = {}
-        for key, value in data_old.items():
-            if isinstance(value, datastore.Key):
-                value = value.id_or_name
-            self._data[key] = value
-        result = super().dump()
-        self._data = data_old
-        return result
+    def items(self):
+        self.resolve()
+        return super().items()
 
-    def get(self, name, to_raise=KeyError):
-        value = super().get(name, to_raise)
-        if isinstance(value, datastore.Key):
-            value = value.id_or_name
+    def values(self):
+        self.resolve()
+        return super().values()
+
+    def _resolve(self, name):
+        """ Replace a deferred value by its conversion and a sharded blob by its value, fetching the shards """
+        value = self._data.get(name)
+        if isinstance(value, Deferred):
+            value = self._data[name] = value.convert(value.value)
+        if isinstance(value, Shards):
+            value = self._data[name] = value.load(self._data['_id'], name)
         return value
 
+    def resolve(self):
+        """ Resolve all deferred and sharded values """
+        for name, value in list(self._data.items()):
+            if isinstance(value, (Deferred, Shards)):
+                self._resolve(name)
+
+    def get_modified_fields(self):
+        modified = self.get_modified_fields_by_mongo_name()
+        return [name for name, field in self._fields.items() if (field.attribute or name) in modified]
+
+    def get_modified_fields_by_mongo_name(self):
+        """ Names of the fields set or deleted, or modified in place (lists, dicts and embedded documents) """
+        modified = set(self._modified_data)
+        modified.update(name for name, value in self._data.items() if _is_modified(value))
+        return modified
+
+    def required_validate(self):
+        # Deferred values were stored as such and are not converted for the sake of validation
+        errors = {}
+        for name, field in self.schema.fields.items():
+            value = self._data[field.attribute or name]
+            if field.required and value is missing:
+                errors[name] = [_("Missing data for required field.")]
+            elif hasattr(field, '_required_validate') and not isinstance(value, Deferred):
+                try:
+                    field._required_validate(value)  # pylint: disable=W0212
+                except ValidationError as exc:
+                    errors[name] = exc.messages
+        if errors:
+            raise ValidationError(errors)
+
+
+class KeyTranslatingBaseDataProxy(KeyTranslatingMixin, BaseDataProxy):
+    __slots__ = ('_encoded', )
+
+
+class KeyTranslatingBaseNonStrictDataProxy(KeyTranslatingMixin, BaseNonStrictDataProxy):
+    __slots__ = ('_encoded', )
+
+    def _to_mongo(self):
+        mongo_data = super()._to_mongo()
+        mongo_data.update(self._additional_data)
+        return mongo_data
+
+
+def _key_fields(schema):
+    """ Mongo names of the fields which may hold a datastore.Key: the primary key and references """
+    key_fields = {'_id'}
+    for name, field in schema.fields.items():
+        if field.attribute == '_id' or isinstance(field, ReferenceField):
+            key_fields.add(field.attribute or name)
+    return frozenset(key_fields)
+
 
 def data_proxy_factory(basename, schema, strict=True):
     cls_name = "%sDataProxy" % basename
@@ -54,7 +220,14 @@ def data_proxy_factory(basename, schema, strict=True):
         '__slots__': (),
         'schema': schema,
         '_fields': schema.fields,
-        '_fields_from_mongo_key': {v.attribute or k: v for k, v in schema.fields.items()}
+        '_fields_from_mongo_key': {v.attribute or k: v for k, v in schema.fields.items()},
+        '_key_fields': _key_fields(schema),
+        '_encoded_fields': frozenset(v.attribute or k for k, v in schema.fields.items()
+                                     if isinstance(v, (BytesField, DictField, ListField, EmbeddedField))),
+        '_opaque_fields': frozenset(v.attribute or k for k, v in schema.fields.items()
+                                    if isinstance(v, BytesField) and not v.reuse_encoded),
+        '_sharded_fields': {v.attribute or k: v.shard_size for k, v in schema.fields.items()
+                            if isinstance(v, BytesField) and v.shard_size}
     }
 
     data_proxy_cls = type(
@@ -12,24 +12,101 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from umongo.document import DocumentImplementation
+import time
+
+from google.cloud import datastore
+from umongo.data_objects import Reference
+from umongo.document import DocumentImplementation, DocumentOpts, DocumentTemplate
 from umongo.exceptions import NotCreatedError, ValidationError, DeleteError
 from umongo.frameworks.pymongo import _io_validate_data_proxy
 
+from .aio import AsyncDocumentCursor, run_in_executor
+from .cursor import DocumentCursor
+from .fields import unindexed_paths
 from .helpers import cook_find_filter
+from .mapper import map_documents
+
+
+class DataStoreDocumentOpts(DocumentOpts):
+    """
+    Document options, extended with the datastore specific Meta options:
+
+    ==================== ===========
+    attribute            description
+    ==================== ===========
+    cache                Entity cache (udatastore.cache.BaseCache) used by get,
+                         commit and delete (default: None)
+    unindexed            Dotted field paths excluded from the datastore indexes,
+                         on top of the fields declared with indexed=False (default: ())
+    lazy                 Convert the values of loaded documents on first access
+                         instead of when loading (default: False)
+    parent               Kind (or document) of the parent of new documents, which
+                         must be placed in its entity group (default: None)
+    ==================== ===========
+    """
+
+    def __init__(self, *args, cache=None, unindexed=None, lazy=None, parent=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = cache
+        self.lazy = bool(lazy)
+        self.parent = getattr(parent, '__name__', parent)
+        self.unindexed = tuple(unindexed or ())
+        # Collected on first use, embedded documents may be registered after the document
+        self.exclude_from_indexes = None
+
 
+def _key_of(obj):
+    """ Key of a document, reference or key """
+    if isinstance(obj, datastore.Key):
+        return obj
+    if isinstance(obj, Reference):
+        return obj.pk
+    if not obj.is_created:
+        raise NotCreatedError("Document doesn't exists in database")
+    return obj.pk
 
-class DataStoreDocument(DocumentImplementation):
+
+class DataStoreDocument(DocumentImplementation):  # pylint: disable=R0904
 
     """ The actual framework implementation class. """
 
     __slots__ = ()
 
-    opts = DocumentImplementation.opts
+    opts = DataStoreDocumentOpts(None, DocumentTemplate, abstract=True)
 
-    @staticmethod
-    def excluded_properties():
-        return ()
+    @classmethod
+    def excluded_properties(cls):
+        """
+        Properties excluded from the datastore indexes, computed once per document class
+        """
+        excluded = cls.opts.exclude_from_indexes
+        if excluded is None:
+            excluded = cls.opts.exclude_from_indexes = unindexed_paths(cls.schema, cls.opts.unindexed)
+        return excluded
+
+    @property
+    def parent_key(self):
+        """
+        Key of the parent of the document, None for root documents.
+        """
+        key = self._data.get_by_mongo_name('_id')
+        return key.parent if isinstance(key, datastore.Key) else None
+
+    def set_parent(self, parent):
+        """
+        Place a new document in the entity group of parent (a document, reference or key).
+        Returns the document.
+        """
+        if self.is_created:
+            raise ValidationError("The parent of a created document can't change")
+        parent = _key_of(parent)
+        if self.opts.parent is not None and parent.kind != self.opts.parent:
+            raise ValidationError("{0} expected as parent, got {1}".format(self.opts.parent, parent.kind))
+        ref = self._data.get_by_mongo_name('_id')
+        if isinstance(ref, datastore.Key):
+            ref = ref.id_or_name
+        self._data.set_by_mongo_name('_id', self.collection.key(ref or None, parent=parent))  # pylint: disable=E1101
+        return self
 
     def reload(self):
         """
@@ -37,7 +114,7 @@ class DataStoreDocument(DocumentImplementation):
         """
         if not self.is_created:
             raise NotCreatedError("Document doesn't exists in database")
-        ret = self.get(self.pk.id_or_name)
+        ret = self.collection.get(self.pk)  # pylint: disable=E1101
         if ret is None:
             raise NotCreatedError("Document doesn't exists in database")
         self._data = self.DataProxy()
@@ -48,36 +125,101 @@ class DataStoreDocument(DocumentImplementation):
         Commit the document in database.
         If the document doesn't already exist it will be inserted, otherwise
         it will be updated.
+
+        With a write buffer on the instance, the document is only enqueued and a Future
+        of its write is returned, see udatastore.buffer.
        """
+        instance = self.opts.instance
+        if instance.current_transaction is None:
+            session = instance.current_session
+            if session is not None and session.defer_commits:
+                session.add(self)
+                return None
+            if instance.write_buffer is not None:
+                return instance.write_buffer.add(self, io_validate_all=io_validate_all)
         return self.commit_multi([self], io_validate_all=io_validate_all)
 
     @classmethod
     def commit_multi(cls, docs, io_validate_all=False):
-        # pylint: disable=W0212
-        payloads = []
-        try:
+        """
+        Commit documents in batch. Invalid documents raise a ValidationError before anything is written,
+        errors of the writes themselves are raised as is (BatchError).
+        """
+        transaction = cls.opts.instance.current_transaction
+        if transaction is not None:
             for doc in docs:
-                if doc.is_modified():
-                    doc.required_validate()
-                    doc.io_validate(validate_all=io_validate_all)
-                    payloads.append(doc._data.to_mongo(update=False))
-
-            keys = cls.collection.put_multi(  # pylint: disable=E1101
-                payloads,
-                exclude_from_indexes=cls.excluded_properties()
-            )
-
-            for key, doc in zip(keys, docs):
-                if not doc.is_created:
-                    doc._data.set_by_mongo_name('_id', key)
-
+                transaction.add(doc)
+            return
+        session = cls.opts.instance.current_session
+        try:
+            prepared = list(cls._prepare_commit(docs, io_validate_all))
         except Exception as exc:
             # Need to dig into error message to find faulting index
             raise ValidationError(str(exc))
+        for doc in cls._commit_prepared(prepared):
+            if session is not None:
+                session.register(doc)
 
+    @classmethod
+    def commit_stream(cls, docs, io_validate_all=False, size=500, workers=None):
+        """
+        Commit an iterable of documents, validating and serializing them lazily.
+
+        Chunks of size documents are written as they fill up, the committed documents
+        are yielded once their chunk completes. Unlike commit_multi, validation errors
+        only surface when the faulting document is reached.
+        """
+        return cls._commit_prepared(cls._prepare_commit(docs, io_validate_all), size=size, workers=workers)
+
+    @staticmethod
+    def _prepare_commit(docs, io_validate_all):
+        # pylint: disable=W0212
         for doc in docs:
-            doc.is_created = True
-            doc._data.clear_modified()
+            if doc._data.partial:
+                raise ValidationError("Cannot commit a partially loaded document")
+            if doc.opts.parent is not None and doc.parent_key is None:
+                raise ValidationError("{0} documents must have a {1} parent".format(
+                    type(doc).__name__, doc.opts.parent))
+            if doc.is_modified():
+                instrumentation = doc.opts.instance.db.instrumentation
+                start = time.perf_counter() if instrumentation.enabled else None
+                doc.required_validate()
+                doc.io_validate(validate_all=io_validate_all)
+                payload = doc._data.to_mongo(update=False)
+                if start is not None:
+                    instrumentation.serialization(doc.opts.collection_name, 'commit', 1,
+                                                  time.perf_counter() - start)
+                yield doc, payload
+
+    @classmethod
+    def _commit_prepared(cls, prepared, size=500, workers=None):
+        # pylint: disable=W0212
+        pending = {}
+
+        def payloads():
+            for position, (doc, payload) in enumerate(prepared):
+                pending[position] = doc, payload
+                yield payload
+
+        for offset, keys in cls.collection.put_stream(  # pylint: disable=E1101
+                payloads(),
+                size=size,
+                exclude_from_indexes=cls.excluded_properties(),
+                workers=workers,
+                cache=cls.opts.cache,
+                sharded=cls.DataProxy._sharded_fields):
+            committed = [(key,) + pending.pop(position) for position, key in enumerate(keys, offset)]
+            # Shards of values which shrank are no longer referenced
+            stale = [shard_key for key, doc, payload in committed for shard_key in doc._data.stale_shards(key, payload)]
+            if stale:
+                cls.collection.delete_multi(stale, cache=cls.opts.cache)  # pylint: disable=E1101
+            for key, doc, payload in committed:
+                if not doc.is_created:
+                    doc._data.set_by_mongo_name('_id', key)
+                doc.is_created = True
+                doc._data.clear_modified()
+                doc._data.remember_encoded(payload)
+                yield doc
 
     def delete(self):
         """
@@ -87,56 +229,155 @@ class DataStoreDocument(DocumentImplementation):
 
     @classmethod
     def delete_multi(cls, entities):
+        """
+        Delete documents in batch. Errors of the deletes are raised as a DeleteError caused by the original error.
+        """
+        transaction = cls.opts.instance.current_transaction
+        if transaction is not None:
+            for entity in entities:
+                transaction.delete(entity)
+            return
         for entity in entities:
             if not entity.is_created:
                 raise NotCreatedError("Document doesn't exists in database")
         try:
-            cls.collection.delete_multi([e.pk for e in entities])  # pylint: disable=E1101
+            cls.collection.delete_multi(  # pylint: disable=E1101
+                [e.pk for e in entities], cache=cls.opts.cache,
+                sharded=bool(cls.DataProxy._sharded_fields))  # pylint: disable=W0212
+            session = cls.opts.instance.current_session
             for entity in entities:
+                if session is not None:
+                    session.evict(entity.pk)
                 entity.is_created = False
         except Exception as exc:
-            raise DeleteError(str(exc))
+            raise DeleteError(str(exc)) from exc
 
     def io_validate(self, validate_all=False):
         """
-        Run the io_validators of the document's fields.
+        Run the io_validators of the modified fields, or of all fields with validate_all.
         """
         if validate_all:
+            self._data.resolve()
             return _io_validate_data_proxy(self.schema, self._data)
-        else:
-            return _io_validate_data_proxy(
-                self.schema, self._data, partial=self._data.get_modified_fields())
+        modified = self._data.get_modified_fields()
+        if not modified:
+            # An empty partial would validate all fields
+            return None
+        return _io_validate_data_proxy(self.schema, self._data, partial=modified)
 
     @classmethod
-    def find_one(cls, filters=None, order=()):
+    def find_one(cls, filters=None, order=(), ancestor=None):
         """
         Find a single document in database.
         """
         try:
-            doc = next(cls.find(filters, limit=1, order=order))
+            doc = next(cls.find(filters, limit=1, order=order, ancestor=ancestor))
         except StopIteration:
             doc = None
         return doc
 
     @classmethod
-    def find(cls, filters=None, order=(), limit=None):
+    def find(cls, filters=None, order=(), limit=None, prefetch=(), page_size=None, start_cursor=None,
+             keys_only=False, projection=(), lazy=None, ancestor=None, key_range=None):
         """
         Find a list document in database.
 
-        Returns a cursor that provide Documents.
+        Returns a cursor that provide Documents. With a page_size, results are fetched page by page
+        and the cursor exposes next_cursor, which can be passed as start_cursor to resume the query.
+        References on the prefetch paths are resolved per page, see udatastore.prefetch.
+
+        With keys_only, the cursor provides the keys of the matching documents. A projection on
+        (indexed) fields provides partial documents holding only those fields, which can't be committed.
+        With lazy, field values are converted on first access, defaults to the lazy Meta option.
+        With an ancestor (a document, reference or key), only documents in its entity group are found.
+        A key_range (start, end) of keys, see key_ranges, restricts the query to start <= key < end.
         """
+        # Each query option is a keyword argument with a default, grouping them would break callers
+        # pylint: disable=R0913,R0914
         filters = cook_find_filter(cls, filters or {})
+        if key_range is not None:
+            if '__key__' in filters:
+                raise ValueError("A key_range can't be combined with a filter on the key")
+            start, end = key_range
+            bounds = {'$gte': start, '$lt': end}
+            bounds = {oper: key for oper, key in bounds.items() if key is not None}
+            if bounds:
+                filters['__key__'] = bounds
+        partial = bool(projection) and not keys_only
+        if keys_only:
+            projection = cls.collection.KEYS_ONLY  # pylint: disable=E1101
+        else:
+            # The key is always part of the results, it can't be projected on
+            projection = [cls.schema.fields[name].attribute or name for name in projection]
+            projection = [name for name in projection if name != '_id']
+            if partial and not projection:
+                # Only the key, which a keys-only query provides
+                projection = cls.collection.KEYS_ONLY  # pylint: disable=E1101
+        pages = cls.collection.query_pages(  # pylint: disable=E1101
+            filters,
+            order=order,
+            limit=limit,
+            page_size=page_size,
+            start_cursor=start_cursor,
+            projection=projection,
+            raw=True,
+            ancestor=_key_of(ancestor) if ancestor is not None else None
+        )
+        return DocumentCursor(cls, pages, prefetch=prefetch, keys_only=keys_only, partial=partial, lazy=lazy)
+
+    @classmethod
+    def key_ranges(cls, partitions, ancestor=None):
+        """
+        Split the documents in at most partitions ranges of keys, to be passed as key_range to find.
+        See CollectionAbstraction.key_ranges.
+        """
+        ancestor = _key_of(ancestor) if ancestor is not None else None
+        return cls.collection.key_ranges(partitions, ancestor=ancestor)  # pylint: disable=E1101
+
+    @classmethod
+    def scan(cls, filters=None, partitions=1, **kwargs):
+        """
+        Split a (full) scan of the documents matching the filters in independent cursors over ranges of keys.
+
+        Returns a list of at most partitions cursors, which can be consumed concurrently, the other arguments
+        are the ones of find. To scan in separate processes, hand each one a range of key_ranges and
+        pass it as key_range to find instead. As the key is filtered on, the filters can't hold inequalities
+        on other fields and there is no order.
+        """
+        ranges = cls.key_ranges(partitions, ancestor=kwargs.get('ancestor'))
+        return [cls.find(filters, key_range=key_range, **kwargs) for key_range in ranges]
+
+    @classmethod
+    def map(cls, fn, filters=None, workers=None, chunk_size=100, executor=None, initializer=None,
+            io_validate_all=False, progress=None, ancestor=None):
+        """
+        Apply fn to each document matching the filters in a pool of workers processes, writing back the
+        documents it modified. Returns a MapReport (see udatastore.mapper) with the processed, written and
+        missing document counts, the throughput and the keys of the documents fn or the commit failed on,
+        along with the errors.
+
+        Keys are streamed from a keys only query, chunks of chunk_size keys are sent to the workers which
+        retrieve the documents with get_multi and commit them with commit_multi. At most two chunks per
+        worker are in flight. progress is called with the report after each chunk.
 
-        for ret in cls.collection.query(filters, order=order, limit=limit):  # pylint: disable=E1101
-            yield cls.build_from_mongo(ret, use_cls=True)
+        Workers are forked, they inherit the instance and fn (which need not be picklable). Clients which
+        don't survive a fork should be set up again by the initializer, called in each worker before its first
+        chunk. Another executor can be given, as long as its workers start after map is called: a thread pool
+        or a process pool forking on demand, workers started before raise a MapError.
+        """
+        # pylint: disable=R0913
+        return map_documents(cls, fn, filters=filters, workers=workers, chunk_size=chunk_size, executor=executor,
+                             initializer=initializer, io_validate_all=io_validate_all, progress=progress,
+                             ancestor=ancestor)
 
     @classmethod
-    def count(cls, filters=None):
+    def count(cls, filters=None, ancestor=None):
         """
-        Get the number of documents in this collection.
+        Get the number of documents in this collection, or in the entity group of ancestor.
         """
         filters = cook_find_filter(cls, filters or {})
-        return len(list(cls.find(filters)))
+        ancestor = _key_of(ancestor) if ancestor is not None else None
+        return cls.collection.count(filters, ancestor=ancestor)  # pylint: disable=E1101
 
     @classmethod
     def ensure_indexes(cls):
@@ -152,5 +393,78 @@ class DataStoreDocument(DocumentImplementation):
 
     @classmethod
     def get_multi(cls, pks):
-        returned = cls.collection.get_multi(pks)  # pylint: disable=E1101
-        return list(map(lambda r: cls.build_from_mongo(r, use_cls=True), returned))
+        session = cls.opts.instance.current_session
+        if session is None:
+            return cls._load_multi(pks)
+
+        keys = [cls.collection.key(pk) for pk in pks]  # pylint: disable=E1101
+        docs = {key: session.get(key) for key in keys}
+        missing = [key for key, doc in docs.items() if doc is None]
+        for key, doc in zip(missing, cls._load_multi(missing)):
+            docs[key] = session.register(doc) if doc is not None else None
+        return [docs[key] for key in keys]
+
+    @classmethod
+    def _load_multi(cls, pks):
+        loader = cls.opts.instance.loader
+        if loader is not None and len(pks) == 1 and cls.collection.client.current_batch is None:
+            returned = [loader.load(cls, pks[0])]
+        else:
+            returned = cls.collection.get_multi(pks, cache=cls.opts.cache, raw=True)  # pylint: disable=E1101
+        instrumentation = cls.opts.instance.db.instrumentation
+        start = time.perf_counter() if instrumentation.enabled else None
+        docs = [cls.build_from_entity(e) if e is not None else None for e in returned]
+        if start is not None:
+            instrumentation.serialization(cls.opts.collection_name, 'get', len(docs), time.perf_counter() - start)
+        return docs
+
+    @classmethod
+    def build_from_entity(cls, entity, partial=False, lazy=None):
+        """
+        Create a document from a datastore entity, using the document class given by its _cls if any.
+        Faster equivalent of build_from_mongo, see udatastore.hydrator.
+        """
+        document_cls = cls
+        if '_cls' in entity:
+            document_cls = cls.opts.instance.retrieve_document(entity['_cls'])
+        return document_cls.hydrate(entity, partial=partial, lazy=lazy)
+
+    # Asynchronous API, the blocking calls run in the executor of the instance.
+    # Sessions are bound to a thread and are therefore not visible to these calls.
+
+    @classmethod
+    async def async_get(cls, key):
+        return await run_in_executor(cls.opts.instance, cls.get, key)
+
+    @classmethod
+    async def async_get_multi(cls, pks):
+        return await run_in_executor(cls.opts.instance, cls.get_multi, pks)
+
+    @classmethod
+    def async_find(cls, *args, **kwargs):
+        """
+        Same as find, returns an asynchronous iterator fetching the next page while the current one is consumed.
+        """
+        return AsyncDocumentCursor(cls.find(*args, **kwargs))
+
+    @classmethod
+    async def async_find_one(cls, filters=None, order=(), ancestor=None):
+        return await run_in_executor(cls.opts.instance, cls.find_one, filters, order=order, ancestor=ancestor)
+
+    @classmethod
+    async def async_count(cls, filters=None, ancestor=None):
+        return await run_in_executor(cls.opts.instance, cls.count, filters, ancestor=ancestor)
+
+    async def async_commit(self, io_validate_all=False):
+        return await run_in_executor(self.opts.instance, self.commit, io_validate_all=io_validate_all)
+
+    @classmethod
+    async def async_commit_multi(cls, docs, io_validate_all=False):
+        return await run_in_executor(cls.opts.instance, cls.commit_multi, docs, io_validate_all=io_validate_all)
+
+    async def async_delete(self):
+        return await run_in_executor(self.opts.instance, self.delete)
+
+    @classmethod
+    async def async_delete_multi(cls, entities):
+        return await run_in_executor(cls.opts.instance, cls.delete_multi, entities)
@@ -12,14 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import lzma
 import pickle
+import struct
+import zlib
 
 import umongo
-from umongo.exceptions import ValidationError
-from umongo.data_objects import Reference, Dict
+from umongo.exceptions import ValidationError, DocumentDefinitionError
+from umongo.data_objects import Reference, Dict, List
 from marshmallow import fields as ma_fields
 from marshmallow import missing
 
+from .shards import Shards, is_manifest
+
 
 class ReferenceField(umongo.fields.ReferenceField):
     """
@@ -61,20 +66,212 @@ class _MaBytesField(ma_fields.Field):
         return value
 
 
+# Encoded values start with a zero byte, which no pickle opcode uses, followed by the codec and compression ids
+_HEADER = b'\x00'
+
+
+def _numpy_encode(value):
+    # numpy is optional, only needed by the numpy codec
+    import numpy as np  # pylint: disable=C0415
+    if not isinstance(value, np.ndarray) or value.dtype.hasobject:
+        raise ValidationError("Numpy array of a non-object dtype expected.")
+    meta = '{0}|{1}'.format(value.dtype.str, ','.join(str(dim) for dim in value.shape)).encode('ascii')
+    buffer = memoryview(np.ascontiguousarray(value).reshape(-1).view(np.uint8))
+    return b''.join((struct.pack('<H', len(meta)), meta, buffer))
+
+
+def _numpy_decode(data, encoding):  # pylint: disable=W0613
+    # encoding is only used by the pickle codec
+    import numpy as np  # pylint: disable=C0415
+    size, = struct.unpack_from('<H', data)
+    dtype, shape = bytes(data[2:2 + size]).decode('ascii').split('|')
+    shape = tuple(int(dim) for dim in shape.split(',') if dim)
+    return np.frombuffer(data, dtype=np.dtype(dtype), offset=2 + size).reshape(shape).copy()
+
+
+# name: (id, encode, decode)
+_CODECS = {
+    'pickle': (1, lambda value: pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+               lambda data, encoding: pickle.loads(data, encoding=encoding)),
+    'raw': (2, bytes, lambda data, encoding: bytes(data)),
+    'numpy': (3, _numpy_encode, _numpy_decode),
+}
+_DECODERS = {codec_id: decode for codec_id, _, decode in _CODECS.values()}
+
+# name: (id, compress)
+_COMPRESSIONS = {
+    'zlib': (1, zlib.compress),
+    'lzma': (2, lzma.compress),
+}
+_DECOMPRESSORS = {1: zlib.decompress, 2: lzma.decompress}
+
+
 class BytesField(umongo.abstract.BaseField, _MaBytesField):
-    def __init__(self, *args, encoding='ASCII', **kwargs):
+    """
+    Arbitrary value, stored as a blob. Blobs are excluded from the datastore indexes unless indexed=True is passed.
+
+    By default values are pickled as is. Passing a codec stores a small header in front of the encoded value:
+
+    * pickle: pickle with the highest protocol
+    * raw: bytes, stored unchanged
+    * numpy: numpy arrays, stored as their dtype, shape and raw buffer
+
+    With compression ('zlib' or 'lzma'), encoded values of at least compress_threshold bytes are compressed.
+    Values are decoded according to their header, values without one are read as plain pickles.
+
+    With a shard_size, encoded values larger than shard_size bytes are split over child entities of the
+    document (top level fields only). These are written along with the document and fetched on first access.
+
+    The stored value is reused when a loaded document is committed again without setting the field, as long as
+    the value is immutable (bytes, str, numbers and tuples of these). Other values may have changed in place
+    and are encoded again, unless reuse_encoded=True promises they are never modified in place.
+    """
+    def __init__(self, *args, encoding='ASCII', codec=None, compression=None, compress_threshold=1024,
+                 shard_size=None, reuse_encoded=False, **kwargs):
+        # pylint: disable=R0913
+        kwargs.setdefault('indexed', False)
         super(BytesField, self).__init__(*args, **kwargs)
         self._encoding = encoding
+        if codec is None and compression is not None:
+            codec = 'pickle'
+        if codec is not None and codec not in _CODECS:
+            raise ValueError("Unknown codec {0}, expected one of {1}".format(codec, sorted(_CODECS)))
+        if compression is not None and compression not in _COMPRESSIONS:
+            raise ValueError("Unknown compression {0}, expected one of {1}".format(
+                compression, sorted(_COMPRESSIONS)))
+        self.codec = codec
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.shard_size = shard_size
+        self.reuse_encoded = reuse_encoded
+        # Cache of the document, shards are fetched through it, set by the builder
+        self.shard_cache = None
+
+    def encode(self, obj):
+        """ Encode a value to the bytes stored in datastore """
+        if self.codec is None:
+            return pickle.dumps(obj)
+        codec_id, encode, _ = _CODECS[self.codec]
+        data = encode(obj)
+        compression_id = 0
+        if self.compression is not None and len(data) >= self.compress_threshold:
+            compression_id, compress = _COMPRESSIONS[self.compression]
+            data = compress(data)
+        return b''.join((_HEADER, bytes((codec_id, compression_id)), data))
+
+    def decode(self, value):
+        """ Decode bytes stored in datastore, with or without header """
+        if not value.startswith(_HEADER):
+            return pickle.loads(value, encoding=self._encoding)
+        if is_manifest(value):
+            return Shards(self, value)
+        data = memoryview(value)[3:]
+        if value[2]:
+            data = _DECOMPRESSORS[value[2]](data)
+        return _DECODERS[value[1]](data, self._encoding)
+
+    def _serialize(self, value, attr, obj):
+        if value is None:
+            return None
+        return self.encode(value)
+
+    def _deserialize(self, value, attr, data):
+        if self.codec == 'raw':
+            if not isinstance(value, (bytes, bytearray, memoryview)):
+                raise ValidationError("Bytes expected.")
+            return bytes(value)
+        if isinstance(value, bytes):
+            return self.decode(value)
+        return value
 
     def _serialize_to_mongo(self, obj):
         if obj is None:
             return missing
-        return pickle.dumps(obj)
+        if isinstance(obj, Shards):
+            return obj.manifest
+        return self.encode(obj)
 
     def _deserialize_from_mongo(self, value):
         if value is None:
             return None
-        return pickle.loads(value, encoding=self._encoding)
+        return self.decode(value)
+
+
+class TrackedDict(Dict):
+    """
+    umongo.data_objects.Dict which marks itself modified when changed in place, like umongo.data_objects.List
+    """
+    __slots__ = ()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.set_modified()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.set_modified()
+
+    def clear(self):
+        super().clear()
+        self.set_modified()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self.set_modified()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self.set_modified()
+        return item
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.set_modified()
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.set_modified()
+
+
+class TrackedList(List):
+    """
+    umongo.data_objects.List which also marks itself modified on insertions, deletions and in place operators
+    """
+    __slots__ = ()
+
+    def insert(self, index, obj):
+        super().insert(index, self.container_field.deserialize(obj))
+        self.set_modified()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.set_modified()
+
+    def __iadd__(self, iterable):
+        self.extend(iterable)
+        return self
+
+    def __imul__(self, count):
+        super().__imul__(count)
+        self.set_modified()
+        return self
+
+
+class ListField(umongo.fields.ListField):
+    """
+    umongo.fields.ListField holding TrackedLists, the builder converts the umongo.fields.ListFields of the templates
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('missing', lambda: TrackedList(self.container))
+        super().__init__(*args, **kwargs)
+
+    def _deserialize(self, value, attr, data):
+        return TrackedList(self.container, super()._deserialize(value, attr, data))
+
+    def _deserialize_from_mongo(self, value):
+        return TrackedList(self.container, super()._deserialize_from_mongo(value))
 
 
 class DictField(umongo.fields.DictField):
@@ -82,9 +279,9 @@ class DictField(umongo.fields.DictField):
         value = super()._deserialize(value, attr, data)
         if isinstance(value, dict):
             altered_val = {self._reverse_replace_dot(k): v for k, v in value.items()}
-            return Dict(altered_val)
+            return TrackedDict(altered_val)
         else:
-            return Dict(value)
+            return TrackedDict(value)
 
     def _serialize_to_mongo(self, obj):
         if not obj:
@@ -113,9 +310,9 @@ class DictField(umongo.fields.DictField):
         if value:
             val_dict = Dict(value)
             altered_val = {self._reverse_replace_dot(k): v for k, v in val_dict.items()}
-            return altered_val
+            return TrackedDict(altered_val)
         else:
-            return Dict()
+            return TrackedDict()
 
 
 
@@ -130,9 +327,61 @@ SUPPORTED_FIELD_TYPES = [
     umongo.fields.EmailField,
     umongo.fields.EmbeddedField,
     umongo.fields.ListField,
+    ListField,
     DictField,
     umongo.fields.FormattedStringField,
     umongo.fields.FloatField,
     ReferenceField,
     BytesField
 ]
+
+
+def _is_indexed(field):
+    if not field.metadata.get('indexed', True):
+        return False
+    if isinstance(field, umongo.fields.ListField):
+        return field.container.metadata.get('indexed', True)
+    return True
+
+
+def _embedded_schema(field):
+    if isinstance(field, umongo.fields.ListField):
+        field = field.container
+    if isinstance(field, umongo.fields.EmbeddedField):
+        return field.embedded_document_cls.schema
+    return None
+
+
+def _resolve_path(schema, path):
+    """ Translate a dotted path of field names into the dotted path of the stored properties """
+    properties = []
+    for name in path.split('.'):
+        field = schema.fields.get(name) if schema is not None else None
+        if field is None:
+            raise DocumentDefinitionError("Unknown field `{0}` in unindexed path `{1}`".format(name, path))
+        properties.append(field.attribute or name)
+        schema = _embedded_schema(field)
+    return '.'.join(properties)
+
+
+def _unindexed_fields(schema, prefix, seen):
+    for name, field in schema.fields.items():
+        path = prefix + (field.attribute or name)
+        if not _is_indexed(field):
+            yield path
+            continue
+        embedded = _embedded_schema(field)
+        if embedded is not None and embedded not in seen:
+            yield from _unindexed_fields(embedded, path + '.', seen | {embedded})
+
+
+def unindexed_paths(schema, unindexed=()):
+    """
+    Dotted paths of the properties to exclude from the datastore indexes: the fields declared with indexed=False,
+    also inside embedded documents and lists of them, and the paths listed in Meta.unindexed
+    """
+    paths = set(_unindexed_fields(schema, '', {schema}))
+    paths.update(_resolve_path(schema, path) for path in unindexed)
+    # Excluding a property covers the nested ones
+    return frozenset(path for path in paths
+                     if not any(path.startswith(other + '.') for other in paths))
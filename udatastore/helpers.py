@@ -12,14 +12,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import copy
+import collections
+import heapq
 import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from functools import partial
+from functools import lru_cache, partial
 
 from google.cloud import datastore
 from umongo.frameworks import tools
 
+from . import shards
+from .instrumentation import NO_INSTRUMENTATION
+
 
 def cook_find_filter(doc_cls, filters):
     filters = tools.cook_find_filter(doc_cls, filters)
@@ -29,15 +35,27 @@ def cook_find_filter(doc_cls, filters):
     return filters
 
 
+def _identity(value):
+    return value
+
+
+def chunked(iterable, size):
+    """ Lazily split an iterable in lists of at most size items. """
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
 def _apply_filter(query, *args, fresh=False):
     if fresh:
-        query = datastore.Query(
-            client=query._client,  # pylint: disable=W0212
+        # Create the copy through the client, so client specific query classes are preserved
+        query = query._client.query(  # pylint: disable=W0212
             kind=query.kind,
-            project=query.project,
             namespace=query.namespace,
             ancestor=query.ancestor,
-            filters=copy.deepcopy(query.filters),
+            filters=query.filters,
             projection=query.projection,
             order=query.order,
             distinct_on=query.distinct_on
@@ -46,14 +64,138 @@ def _apply_filter(query, *args, fresh=False):
     return query
 
 
+def _lookup(entity, name):
+    value = entity
+    for part in name.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _sort_value(value):
+    """ Map a property value on a comparable value, ranking types the way datastore orders them """
+    # pylint: disable=R0911
+    if value is None:
+        return (0, )
+    if isinstance(value, bool):
+        return (3, value)
+    if isinstance(value, int):
+        return (1, value)
+    if isinstance(value, datetime):
+        return (2, value.replace(tzinfo=None))
+    if isinstance(value, bytes):
+        return (4, value)
+    if isinstance(value, str):
+        return (5, value)
+    if isinstance(value, float):
+        return (6, value)
+    if isinstance(value, datastore.Key):
+        return (7, tuple((e['kind'], 'name' in e, e.get('id', e.get('name'))) for e in value.path))
+    return (8, repr(value))
+
+
+class _Descending:
+    __slots__ = ('value', )
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _order_key(order):
+    """
+    Sort key reproducing the order of query results: the order properties followed by the key.
+
+    For list properties, datastore sorts on the smallest value ascending and on the largest descending.
+    """
+    properties = [(o.lstrip('-'), o.startswith('-')) for o in order]
+
+    def key(entity):
+        values = []
+        for name, descending in properties:
+            value = _lookup(entity, name)
+            if isinstance(value, list):
+                value = max(map(_sort_value, value)) if descending else min(map(_sort_value, value))
+            else:
+                value = _sort_value(value)
+            values.append(_Descending(value) if descending else value)
+        values.append(_sort_value(entity.key))
+        return tuple(values)
+    return key
+
+
+def _prefetched(executor, pages):
+    """ Iterate the entities of pages, fetching the next page in the background """
+    pages = iter(pages)
+    future = executor.submit(next, pages, None)
+    while True:
+        page = future.result()
+        if page is None:
+            return
+        future = executor.submit(next, pages, None)
+        yield from page
+
+
+@lru_cache(maxsize=None)
+def _split_paths(paths):
+    """ Split dotted property paths in the top level names and the nested paths per top level name """
+    names, nested = set(), collections.defaultdict(set)
+    for path in paths:
+        head, _, rest = path.partition('.')
+        if rest:
+            nested[head].add(rest)
+        else:
+            names.add(head)
+    return tuple(sorted(names)), {head: frozenset(rest) for head, rest in nested.items()}
+
+
+def _embed(value, paths):
+    """ Wrap embedded dicts, also in lists, in entities excluding the dotted paths from the indexes """
+    if isinstance(value, list):
+        return [_embed(item, paths) for item in value]
+    if isinstance(value, dict):
+        names, nested = _split_paths(paths)
+        entity = datastore.Entity(exclude_from_indexes=names)
+        entity.update(value)
+        for name, rest in nested.items():
+            if name in entity:
+                entity[name] = _embed(entity[name], rest)
+        return entity
+    return value
+
+
+class BatchError(Exception):
+    """
+    Raised when one or more chunks of a batched operation failed.
+
+    All chunks are attempted, failures holds a (chunk, exception) tuple for each failed chunk.
+    """
+    def __init__(self, failures):
+        super().__init__('{0} chunk(s) failed: {1}'.format(
+            len(failures), '; '.join(str(exc) for _, exc in failures)))
+        self.failures = failures
+
+
 class DataStoreClientWrapper:
-    """ For compatibility with the collection property in umongo """
-    def __init__(self, client):
+    """
+    For compatibility with the collection property in umongo
+
+    Client calls and (de)serialization are reported to instrumentation, see udatastore.instrumentation.
+    """
+    def __init__(self, client, workers=1, instrumentation=None):
         super().__init__()
         self.client = client
+        self.workers = workers
+        self.instrumentation = instrumentation or NO_INSTRUMENTATION
 
     def __getitem__(self, cname) -> 'CollectionAbstraction':
-        return CollectionAbstraction(self.client, cname)
+        return CollectionAbstraction(self.client, cname, workers=self.workers, instrumentation=self.instrumentation)
 
 
 class CollectionAbstraction:
@@ -73,10 +215,65 @@ class CollectionAbstraction:
         '$in': lambda q, k, v: [_apply_filter(q, k, '=', i, fresh=True) for i in v]
     }
 
-    def __init__(self, client, cname):
+    KEYS_ONLY = ('__key__', )
+    MERGE_PAGE_SIZE = 1000
+    # Threads fetching the queries of an $in fan out, unless the collection has more workers
+    MERGE_WORKERS = 8
+    # Keys sampled per split point by key_ranges
+    SCATTER_OVERSAMPLING = 32
+    # Bytes of shards written per put_multi, the commit request size is limited to 10MiB
+    SHARD_CHUNK_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, client, cname, workers=1, instrumentation=None):
         super(CollectionAbstraction, self).__init__()
         self.client = client
         self.cname = cname
+        self.workers = workers
+        self.instrumentation = instrumentation or NO_INSTRUMENTATION
+
+    def _instrumented(self, operation, func):
+        """ Wrap a client call taking a chunk, to report it as an RPC """
+        instrumentation = self.instrumentation
+        if not instrumentation.enabled:
+            return func
+
+        def timed(chunk):
+            start = time.perf_counter()
+            try:
+                return func(chunk)
+            finally:
+                instrumentation.rpc(self.cname, operation, len(chunk), time.perf_counter() - start)
+        return timed
+
+    def _instrumented_pages(self, pages, operation='query'):
+        """ Wrap the pages of a query, to report the fetch of each page as an RPC """
+        if not self.instrumentation.enabled:
+            return pages
+        return self._timed_pages(pages, operation)
+
+    def _timed_pages(self, pages, operation):
+        pages = iter(pages)
+        while True:
+            start = time.perf_counter()
+            try:
+                page = list(next(pages))
+            except StopIteration:
+                return
+            self.instrumentation.rpc(self.cname, operation, len(page), time.perf_counter() - start)
+            yield page
+
+    def _instrumented_packer(self, packer):
+        """ Wrap the packing of payloads, to report it as serialization """
+        instrumentation = self.instrumentation
+        if not instrumentation.enabled:
+            return packer
+
+        def timed(payload):
+            start = time.perf_counter()
+            packed = packer(payload)
+            instrumentation.serialization(self.cname, 'put', 1, time.perf_counter() - start)
+            return packed
+        return timed
 
     @staticmethod
     def _unpack(entity):
@@ -97,57 +294,364 @@ class CollectionAbstraction:
         ref = payload.pop('_id', None)
         if not isinstance(ref, datastore.Key):
             ref = self.key(ref)
-        entity = datastore.Entity(key=ref, exclude_from_indexes=exclude_from_indexes)
+        names, nested = _split_paths(frozenset(exclude_from_indexes))
+        entity = datastore.Entity(key=ref, exclude_from_indexes=names)
         entity.update(payload)
+        for name, rest in nested.items():
+            if name in entity:
+                entity[name] = _embed(entity[name], rest)
         return entity
 
-    def key(self, ref=None):
+    def _pack_sharded(self, payload, exclude_from_indexes=(), sharded=None):
+        """
+        Pack a payload, splitting the values of the sharded properties larger than their shard size over
+        child entities. Returns the entity and its children. The manifests replacing the split values are
+        written back in the payload, so they are what the document remembers as stored.
+        """
+        entity = self._pack(payload, exclude_from_indexes=exclude_from_indexes)
+        children = []
+        for name, shard_size in sharded.items():
+            value = entity.get(name)
+            if isinstance(value, bytes) and len(value) > shard_size:
+                if entity.key.is_partial:
+                    # The children need the complete key of their parent, see _complete_sharded_keys
+                    entity.key = self.client.allocate_ids(entity.key, 1)[0]
+                manifest, name_shards = shards.split(entity.key, name, value, shard_size)
+                entity[name] = payload[name] = manifest
+                children.extend(name_shards)
+        return entity, children
+
+    def _complete_sharded_keys(self, payloads, size, sharded):
+        """
+        Allocate the ids of the new entities with values to shard, their children need the complete key.
+        Ids are allocated once per size payloads, instead of once per entity while packing.
+        """
+        for chunk in chunked(payloads, size):
+            # Partial keys never compare equal, group them by path
+            incomplete = collections.OrderedDict()
+            for payload in chunk:
+                key = self.key(payload.get('_id'))
+                if key.is_partial and any(isinstance(payload.get(name), bytes) and len(payload[name]) > shard_size
+                                          for name, shard_size in sharded.items()):
+                    incomplete.setdefault(key.flat_path, (key, []))[1].append(payload)
+            for key, key_payloads in incomplete.values():
+                for payload, complete in zip(key_payloads, self.client.allocate_ids(key, len(key_payloads))):
+                    payload['_id'] = complete
+            yield from chunk
+
+    def _sharded_chunks(self, packed, size, heads):
+        """
+        Chunk (entity, children) pairs, keeping children in the chunk of their parent, after all parents.
+
+        A chunk holds at most size entities and SHARD_CHUNK_BYTES of shards, unless a single entity needs
+        more. The offset of the first parent and the number of parents per chunk index are stored in heads.
+        """
+        parents, children, weight, offset = [], [], 0, 0
+        index = 0
+        for entity, entity_children in packed:
+            entity_weight = sum(len(child['data']) for child in entity_children)
+            if parents and (len(parents) + len(children) + 1 + len(entity_children) > size or
+                            weight + entity_weight > self.SHARD_CHUNK_BYTES):
+                heads[index] = offset, len(parents)
+                yield parents + children
+                index += 1
+                offset += len(parents)
+                parents, children, weight = [], [], 0
+            parents.append(entity)
+            children.extend(entity_children)
+            weight += entity_weight
+        if parents:
+            heads[index] = offset, len(parents)
+            yield parents + children
+
+    def key(self, ref=None, parent=None):
+        """
+        Key of this kind for an id or name (a partial key if None) under the parent key if any.
+        Keys are returned as is.
+        """
+        if isinstance(ref, datastore.Key):
+            return ref
         if ref:
-            return self.client.key(self.cname, ref)
+            return self.client.key(self.cname, ref, parent=parent)
         else:
-            return self.client.key(self.cname)
+            return self.client.key(self.cname, parent=parent)
 
     def get(self, key):
         return self.get_multi([key])[0]
 
-    def get_multi(self, keys, size=1000):
+    def _dispatch(self, func, chunks, workers=None):
+        """
+        Apply func to each chunk, yielding (index, chunk, result) tuples in input order.
+
+        With more than one worker, up to workers chunks are in flight at once. Inside a batch
+        or transaction, chunks are always sent from the calling thread as the client tracks
+        these per thread. Failing chunks do not stop the others, a BatchError is raised at the end.
+        """
+        workers = workers or self.workers
+        failures = []
+
+        def collect(index, chunk, future):
+            try:
+                return [(index, chunk, future.result())]
+            except Exception as exc:  # pylint: disable=W0703
+                failures.append((chunk, exc))
+                return []
+
+        if workers <= 1 or self.client.current_batch is not None:
+            for index, chunk in enumerate(chunks):
+                try:
+                    result = func(chunk)
+                except Exception as exc:  # pylint: disable=W0703
+                    failures.append((chunk, exc))
+                else:
+                    yield index, chunk, result
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = collections.deque()
+                for index, chunk in enumerate(chunks):
+                    pending.append((index, chunk, executor.submit(func, chunk)))
+                    if len(pending) >= workers:
+                        yield from collect(*pending.popleft())
+                while pending:
+                    yield from collect(*pending.popleft())
+        if failures:
+            raise BatchError(failures)
+
+    def get_multi(self, keys, size=1000, workers=None, cache=None, raw=False):
+        """
+        Retrieve the payloads of the given keys (or ids/names), None for missing entities.
+        With raw, the datastore entities are returned instead of the payloads.
+
+        With a cache (see udatastore.cache), only the keys missing from it are retrieved
+        from datastore, the retrieved entities are then added to the cache.
+        """
         keys_wrapped = list(map(self.key, keys))
-        chunks = [keys_wrapped[x:x + size] for x in range(0, len(keys_wrapped), size)]
-        entities = [entity for chunk in chunks for entity in self.client.get_multi(chunk)]
-        entity_map = {e.key.id_or_name: e for e in entities}
-        return [self._unpack(entity_map.get(key, None)) for key in keys]
+        cached = cache.get_multi(keys_wrapped) if cache is not None else {}
+        missing = [key for key in keys_wrapped if key not in cached]
+        chunks = [missing[x:x + size] for x in range(0, len(missing), size)]
+        dispatched = self._dispatch(self._instrumented('get', self.client.get_multi), chunks, workers=workers)
+        entities = [e for _, _, chunk_entities in dispatched for e in chunk_entities]
+        if cache is not None and entities:
+            cache.set_multi(entities)
+        entity_map = {e.key: e for e in itertools.chain(cached.values(), entities)}
+        unpack = _identity if raw else self._unpack
+        return [unpack(entity_map.get(key, None)) for key in keys_wrapped]
 
     def put(self, payload, *args, **kwargs):
         keys = self.put_multi([payload], *args, **kwargs)
         return keys[0]
 
-    def put_multi(self, payloads, size=500, exclude_from_indexes=()):
-        packer = partial(self._pack, exclude_from_indexes=exclude_from_indexes)
-        entities = list(map(packer, payloads))
-        chunks = [entities[x:x + size] for x in range(0, len(entities), size)]
-        for chunk in chunks:
-            self.client.put_multi(chunk)
-        return [entity.key for chunk in chunks for entity in chunk]
+    def put_multi(self, payloads, size=500, exclude_from_indexes=(), workers=None, cache=None, sharded=None):
+        # Same options as put_stream
+        # pylint: disable=R0913
+        keys = []
+        for _, chunk_keys in self.put_stream(payloads, size=size, exclude_from_indexes=exclude_from_indexes,
+                                             workers=workers, cache=cache, sharded=sharded):
+            keys.extend(chunk_keys)
+        return keys
+
+    def put_stream(self, payloads, size=500, exclude_from_indexes=(), workers=None, cache=None, sharded=None):
+        """
+        Lazily pack and put an iterable of payloads, one chunk of size entities at a time.
+
+        Yields (offset, keys) once a chunk is written, offset being the position of its first payload.
+        At most size * workers entities are held in memory. Written entities are stored in the cache,
+        unless inside a batch or transaction where they are evicted as the write may not happen.
+
+        sharded maps property names to their shard size, larger values are split over child entities
+        which are written in the same put_multi as their parent.
+        """
+        # pylint: disable=R0913,R0914
+        heads = {}
+        if sharded:
+            packer = partial(self._pack_sharded, exclude_from_indexes=exclude_from_indexes, sharded=sharded)
+            payloads = self._complete_sharded_keys(payloads, size, sharded)
+            chunks = self._sharded_chunks(map(self._instrumented_packer(packer), payloads), size, heads)
+        else:
+            packer = partial(self._pack, exclude_from_indexes=exclude_from_indexes)
+            chunks = chunked(map(self._instrumented_packer(packer), payloads), size)
+        put_multi = self._instrumented('put', self.client.put_multi)
+        for index, chunk, _ in self._dispatch(put_multi, chunks, workers=workers):
+            offset, count = heads.pop(index, (index * size, len(chunk)))
+            written = chunk[:count]
+            keys = [entity.key for entity in written]
+            if cache is not None:
+                if self.client.current_batch is None:
+                    cache.set_multi(written)
+                else:
+                    cache.delete_multi(keys)
+                if len(chunk) > count:
+                    # Shards may have been cached when read
+                    cache.delete_multi([entity.key for entity in chunk[count:]])
+            yield offset, keys
 
     def delete(self, key):
         self.delete_multi([key])
 
-    def delete_multi(self, keys, size=500):
+    def delete_multi(self, keys, size=500, workers=None, cache=None, sharded=False):
+        """
+        Delete the entities with the given keys (or ids/names). With sharded, the keys of their shards are
+        read from the manifests of the entities, retrieved in one get_multi, and deleted as well.
+        """
+        keys = list(map(self.key, keys))
+        if sharded:
+            keys += self._shard_keys(keys)
+        if cache is not None:
+            cache.delete_multi(keys)
         chunks = [keys[x:x + size] for x in range(0, len(keys), size)]
-        for chunk in chunks:
-            self.client.delete_multi(chunk)
+        for _ in self._dispatch(self._instrumented('delete', self.client.delete_multi), chunks, workers=workers):
+            pass
 
-    def query(self, filters, limit=None, order=()):
-        queries = [self.client.query(kind=self.cname, order=order)]
+    def _shard_keys(self, keys):
+        """ Keys of the shards of the entities with the given keys """
+        return [key for entity in self.get_multi(keys, raw=True) if entity is not None
+                for key in shards.keys_of(entity)]
+
+    def _build_queries(self, filters, order=(), projection=(), ancestor=None):
+        queries = [self.client.query(kind=self.cname, ancestor=ancestor, order=order, projection=projection)]
         for attr, domain in filters.items():
             if isinstance(domain, dict):
                 for oper, operand in domain.items():
                     query_groups = [self._filter_oper_lookup[oper](query, attr, operand) for query in queries]
-                    queries = itertools.chain(*query_groups)
+                    queries = list(itertools.chain(*query_groups))
             else:
                 for query in queries:
                     query.add_filter(attr, '=', domain)
+        return queries
+
+    def query(self, filters, limit=None, order=()):
+        for payloads, _ in self.query_pages(filters, limit=limit, order=order):
+            yield from payloads
+
+    def _merge(self, queries, limit=None, order=(), operation='query'):
+        """
+        Run queries (from an $in fan out) concurrently, on at most MERGE_WORKERS (or workers) threads,
+        and merge their results.
+
+        Results are merged in the requested order, entities matched by several queries are
+        returned once and the merge stops as soon as limit entities are returned.
+        """
+        if not queries:
+            return
+        executor = None
+        pages = [self._instrumented_pages(query.fetch(limit=limit).pages, operation) for query in queries]
+        if self.client.current_batch is None:
+            executor = ThreadPoolExecutor(max_workers=min(len(queries), max(self.workers, self.MERGE_WORKERS)))
+            streams = [_prefetched(executor, query_pages) for query_pages in pages]
+        else:
+            # Reads in a transaction must happen on the thread owning it
+            streams = [itertools.chain.from_iterable(query_pages) for query_pages in pages]
+
+        seen = set()
+        read = 0
+        try:
+            for entity in heapq.merge(*streams, key=_order_key(order)):
+                read += 1
+                if entity.key in seen:
+                    continue
+                seen.add(entity.key)
+                yield entity
+                if limit and len(seen) >= limit:
+                    return
+        finally:
+            if executor:
+                executor.shutdown(wait=False)
+            if self.instrumentation.enabled:
+                self.instrumentation.query_results(self.cname, read, len(seen))
+
+    def query_pages(self, filters, limit=None, order=(), page_size=None, start_cursor=None, projection=(),
+                    raw=False, ancestor=None):
+        """
+        Run a query page by page, yielding (payloads, cursor) tuples.
+
+        Passing the cursor as start_cursor resumes the query after that page, the cursor is None
+        once the query is exhausted. Without a page_size, pages follow the batches returned by
+        datastore. Cursors are not available for queries fanned out by $in.
+
+        A projection restricts the returned properties, use KEYS_ONLY to only retrieve keys.
+        With raw, pages hold the datastore entities instead of the payloads. With an ancestor key,
+        only its descendants are returned, which is strongly consistent.
+        """
+        # pylint: disable=R0913,R0914
+        unpack = _identity if raw else self._unpack
+        queries = self._build_queries(filters, order=order, projection=projection, ancestor=ancestor)
+        if len(queries) != 1:
+            if page_size or start_cursor:
+                raise ValueError('Cursors are not supported for queries with $in filters')
+            if self.instrumentation.enabled:
+                self.instrumentation.fan_out(self.cname, len(queries))
+            for payloads in chunked(map(unpack, self._merge(queries, limit=limit, order=order)),
+                                    self.MERGE_PAGE_SIZE):
+                yield payloads, None
+            return
+
+        query = queries[0]
+        if not page_size:
+            iterator = query.fetch(limit=limit, start_cursor=start_cursor)
+            for page in self._instrumented_pages(iterator.pages):
+                yield list(map(unpack, page)), iterator.next_page_token
+            yield [], None
+            return
+
+        cursor = start_cursor
+        remaining = limit
+        while True:
+            size = page_size if remaining is None else min(page_size, remaining)
+            iterator = query.fetch(limit=size, start_cursor=cursor)
+            entities, = self._instrumented_pages([iterator])
+            payloads = list(map(unpack, entities))
+            cursor = iterator.next_page_token if len(payloads) == size else None
+            yield payloads, cursor
+            if remaining is not None:
+                remaining -= len(payloads)
+            if cursor is None or remaining == 0:
+                return
+
+    def key_ranges(self, partitions, ancestor=None):
+        """
+        Split the keys of the kind in at most partitions contiguous ranges holding about as many entities.
+
+        Returns (start, end) tuples of keys, start being inclusive and end exclusive, None for an open bound.
+        Split points are picked among a sample of keys ordered by the __scatter__ property, kinds with
+        few entities may therefore be split in fewer ranges.
+        """
+        if partitions < 1:
+            raise ValueError('partitions must be at least 1')
+        if partitions == 1:
+            return [(None, None)]
+        query = self.client.query(kind=self.cname, ancestor=ancestor, order=['__scatter__'],
+                                  projection=self.KEYS_ONLY)
+        pages = self._instrumented_pages(query.fetch(limit=(partitions - 1) * self.SCATTER_OVERSAMPLING).pages)
+        sample = sorted((entity.key for page in pages for entity in page), key=_sort_value)
+        splits = []
+        for index in range(1, partitions):
+            split = sample[len(sample) * index // partitions] if sample else None
+            if split is not None and split not in splits:
+                splits.append(split)
+        bounds = [None] + splits + [None]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _aggregate_count(self, query):
+        aggregation = self.client.aggregation_query(query).count()
+        results = self._instrumented_pages(aggregation.fetch(), 'count')
+        return sum(result.value for page in results for result in page)
+
+    def count(self, filters, ancestor=None):
+        """
+        Count the entities matching the filters without retrieving them.
+
+        A single query is counted server side if the client supports aggregation queries, otherwise
+        a keys-only query is streamed. Fanned out queries ($in) are always merged keys-only, as an
+        entity can match several branches (e.g. on list properties) and must only be counted once.
+        """
+        if hasattr(self.client, 'aggregation_query'):
+            queries = self._build_queries(filters, ancestor=ancestor)
+            if len(queries) == 1:
+                return self._aggregate_count(queries[0])
 
-        for query in queries:
-            for ret in query.fetch(limit=limit):
-                yield self._unpack(ret)
+        queries = self._build_queries(filters, projection=self.KEYS_ONLY, ancestor=ancestor)
+        if len(queries) == 1:
+            return sum(len(page) for page in self._instrumented_pages(queries[0].fetch().pages, 'count'))
+        if self.instrumentation.enabled:
+            self.instrumentation.fan_out(self.cname, len(queries))
+        return sum(1 for _ in self._merge(queries, operation='count'))
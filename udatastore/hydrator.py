@@ -0,0 +1,147 @@
+# Copyright 2019 ML2Grow NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import datetime
+import functools
+
+import umongo
+from umongo.document import DocumentImplementation
+from umongo.exceptions import UnknownFieldInDBError
+from umongo.i18n import gettext as _
+
+from .data_proxy import Deferred
+from .fields import DictField, ReferenceField, TrackedDict, TrackedList
+
+
+# Fields stored in datastore the way they are represented in the DataProxy
+_AS_IS_FIELDS = (
+    umongo.fields.BooleanField,
+    umongo.fields.StringField,
+    umongo.fields.NumberField,
+    umongo.fields.IntegerField,
+    umongo.fields.FloatField,
+    umongo.fields.UrlField,
+    umongo.fields.EmailField,
+    umongo.fields.FormattedStringField,
+)
+
+# Fields stored as timezone aware datetimes, represented as naive ones
+_NAIVE_FIELDS = (
+    umongo.fields.DateTimeField,
+)
+
+
+def _naive(value):
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    return value
+
+
+def _field_converter(field):
+    """
+    Return the function converting an entity value to its DataProxy representation,
+    or None if the value is stored as is. Equivalent to field.deserialize_from_mongo.
+    """
+    # pylint: disable=W0212
+    if type(field) in _AS_IS_FIELDS:
+        return None
+    if type(field) in _NAIVE_FIELDS:
+        return _naive
+    allow_none = getattr(field, 'allow_none', False)
+
+    if isinstance(field, ReferenceField):
+        def convert(value):
+            if value is None and allow_none:
+                return None
+            return field.reference_cls(field.document_cls, value)
+    elif isinstance(field, DictField):
+        unescape = field._reverse_replace_dot
+
+        def convert(value):
+            if value is None and allow_none:
+                return None
+            if not value:
+                return TrackedDict()
+            return TrackedDict({unescape(k): v for k, v in value.items()})
+    elif isinstance(field, umongo.fields.ListField):
+        container = field.container
+        convert_item = _field_converter(container) or (lambda value: value)
+
+        def convert(value):
+            if value is None and allow_none:
+                return None
+            return TrackedList(container, [convert_item(item) for item in value] if value else ())
+    else:
+        convert = field.deserialize_from_mongo
+    return convert
+
+
+def compile_hydrator(document_cls):
+    """
+    Build the function creating documents of document_cls straight from datastore entities.
+
+    The converters of all fields are resolved once, and the document and its DataProxy are
+    filled in directly. This is equivalent to build_from_mongo on the unpacked entity, without
+    running the schema on an empty document first and without the intermediate payload.
+    Documents with a custom constructor are still created through it, their data is then replaced.
+
+    Lazy hydration stores the values of the fields needing a conversion as is, these are converted
+    on first access. lazy defaults to the lazy Meta option of the document.
+    """
+    # pylint: disable=W0212
+    data_proxy_cls = document_cls.DataProxy
+    # Custom constructors must run, as in build_from_mongo
+    construct = document_cls.__init__ is not DocumentImplementation.__init__
+    fields = data_proxy_cls._fields_from_mongo_key
+    converters = {name: _field_converter(field) for name, field in fields.items() if name != '_id'}
+    lazy_converters = {name: convert if convert in (None, _naive) else functools.partial(Deferred, convert)
+                       for name, convert in converters.items()}
+    lazy_default = bool(document_cls.opts.lazy)
+    defaults = [(name, field.missing) for name, field in fields.items()]
+    strict = document_cls.opts.strict
+    encoded_fields = data_proxy_cls._encoded_fields
+
+    def hydrate(entity, partial=False, lazy=None):
+        data = {'_id': entity.key}
+        additional = {}
+        field_converters = lazy_converters if (lazy_default if lazy is None else lazy) else converters
+        for name, value in entity.items():
+            try:
+                convert = field_converters[name]
+            except KeyError:
+                if strict:
+                    raise UnknownFieldInDBError(_('{cls}: unknown "{key}" field found in DB.'.format(
+                        key=name, cls=data_proxy_cls.__name__))) from None
+                additional[name] = _naive(value)
+                continue
+            data[name] = value if convert is None else convert(value)
+
+        proxy = data_proxy_cls.__new__(data_proxy_cls)
+        proxy._data = data
+        proxy._modified_data = set()
+        proxy.not_loaded_fields = set()
+        proxy._encoded = {name: entity[name] for name in encoded_fields if name in entity}
+        if not strict:
+            proxy._additional_data = additional
+        if partial:
+            proxy._collect_partial_fields(data.keys(), as_mongo_fields=True)
+        for name, missing in defaults:
+            if name not in data:
+                data[name] = missing() if callable(missing) else missing
+
+        doc = document_cls() if construct else document_cls.__new__(document_cls)
+        doc._data = proxy
+        doc.is_created = True
+        return doc
+    return hydrate
@@ -12,16 +12,85 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from umongo.instance import LazyLoaderInstance
 from .builder import DataStoreBuilder
 from .helpers import DataStoreClientWrapper
+from .session import Session
+from .transaction import Transaction
 
 
 class DataStoreInstance(LazyLoaderInstance):
 
     def __init__(self, *args, **kwargs):
         self.BUILDER_CLS = DataStoreBuilder  # pylint: disable=C0103
+        self._local = threading.local()
+        self._executor = None
+        self.loader = None
+        self.write_buffer = None
         super().__init__(*args, **kwargs)
 
-    def init(self, db):
-        super(DataStoreInstance, self).init(DataStoreClientWrapper(db))
+    def session(self, defer_commits=False):
+        """
+        Context manager opening a Session (identity map) for the current thread, see udatastore.session.
+        """
+        return Session(self, defer_commits=defer_commits)
+
+    @property
+    def current_session(self):
+        sessions = getattr(self._local, 'sessions', None)
+        return sessions[-1] if sessions else None
+
+    def _push_session(self, session):
+        if not hasattr(self._local, 'sessions'):
+            self._local.sessions = []
+        self._local.sessions.append(session)
+
+    def _pop_session(self):
+        return self._local.sessions.pop()
+
+    def transaction(self, **options):
+        """
+        Context manager committing the writes of the block in a single datastore transaction,
+        retrying contention and transient errors, see udatastore.transaction for the options.
+        """
+        return Transaction(self, **options)
+
+    @property
+    def current_transaction(self):
+        transactions = getattr(self._local, 'transactions', None)
+        return transactions[-1] if transactions else None
+
+    def _push_transaction(self, transaction):
+        if not hasattr(self._local, 'transactions'):
+            self._local.transactions = []
+        self._local.transactions.append(transaction)
+
+    def _pop_transaction(self):
+        return self._local.transactions.pop()
+
+    def init(self, db, workers=1, executor=None, instrumentation=None, loader=None, write_buffer=None):
+        """
+        Set the datastore client to use, workers bounds the number of chunks sent concurrently
+        by batch operations. The executor runs the blocking calls of the async API.
+        Instrumentation receives the timings of the RPCs and serialization, see udatastore.instrumentation.
+        The loader coalesces concurrent single key lookups, see udatastore.loader.
+        The write buffer makes Document.commit write-behind, see udatastore.buffer.
+        """
+        # pylint: disable=R0913
+        super(DataStoreInstance, self).init(DataStoreClientWrapper(db, workers=workers,
+                                                                   instrumentation=instrumentation))
+        self._executor = executor
+        self.loader = loader
+        self.write_buffer = write_buffer
+
+    @property
+    def executor(self):
+        """
+        Executor of the async API, a thread pool is created on first use if none was given to init.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor()
+        return self._executor
@@ -0,0 +1,140 @@
+# Copyright 2019 ML2Grow NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import collections
+import threading
+
+
+class Instrumentation:
+    """
+    Hooks called by CollectionAbstraction and the documents, per kind and operation.
+
+    This base class ignores everything. Call sites skip the hooks (and timing them) entirely unless
+    enabled is set, so the default instrumentation costs nothing. Subclasses set enabled and override
+    the hooks they are interested in, these may be called from several threads at once.
+    """
+    enabled = False
+
+    def rpc(self, kind, operation, entities, seconds):
+        """ A client call (one chunk or query page) for entities entities took seconds (wire time) """
+
+    def serialization(self, kind, operation, entities, seconds):
+        """ Converting entities entities from or to their stored form took seconds (CPU time) """
+
+    def fan_out(self, kind, queries):
+        """ A query with $in filters was split in queries queries """
+
+    def query_results(self, kind, read, yielded):
+        """ A query read read entities and yielded yielded of them, after merging and deduplication """
+
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, float('inf'))
+
+
+class OperationStats:  # pylint: disable=R0902
+    """ Statistics of an operation on a kind, collected by InMemoryCollector """
+
+    def __init__(self):
+        self.rpcs = 0
+        self.entities = 0
+        self.wire_seconds = 0.0
+        self.latencies = [0] * len(LATENCY_BUCKETS)
+        self.serialized = 0
+        self.serialization_seconds = 0.0
+        self.fan_outs = 0
+        self.queries = 0
+        self.read = 0
+        self.yielded = 0
+
+    @property
+    def entities_per_rpc(self):
+        return self.entities / self.rpcs if self.rpcs else 0.0
+
+    @property
+    def fan_out_factor(self):
+        return self.queries / self.fan_outs if self.fan_outs else 1.0
+
+    def as_dict(self):
+        return {
+            'rpcs': self.rpcs,
+            'entities': self.entities,
+            'entities_per_rpc': self.entities_per_rpc,
+            'wire_seconds': self.wire_seconds,
+            'latencies': dict(zip(LATENCY_BUCKETS, self.latencies)),
+            'serialized': self.serialized,
+            'serialization_seconds': self.serialization_seconds,
+            'fan_out_factor': self.fan_out_factor,
+            'read': self.read,
+            'yielded': self.yielded,
+        }
+
+
+class InMemoryCollector(Instrumentation):
+    """
+    Instrumentation keeping OperationStats per (kind, operation) in memory.
+
+    Operations are get, put, delete, query and count for the RPCs, commit, get and find for the
+    serialization of documents.
+    """
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = collections.defaultdict(OperationStats)
+
+    def rpc(self, kind, operation, entities, seconds):
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            stats = self._stats[kind, operation]
+            stats.rpcs += 1
+            stats.entities += entities
+            stats.wire_seconds += seconds
+            stats.latencies[bucket] += 1
+
+    def serialization(self, kind, operation, entities, seconds):
+        with self._lock:
+            stats = self._stats[kind, operation]
+            stats.serialized += entities
+            stats.serialization_seconds += seconds
+
+    def fan_out(self, kind, queries):
+        with self._lock:
+            stats = self._stats[kind, 'query']
+            stats.fan_outs += 1
+            stats.queries += queries
+
+    def query_results(self, kind, read, yielded):
+        with self._lock:
+            stats = self._stats[kind, 'query']
+            stats.read += read
+            stats.yielded += yielded
+
+    def stats(self, kind, operation):
+        """ OperationStats of an operation on a kind """
+        with self._lock:
+            return self._stats[kind, operation]
+
+    def report(self):
+        """ Statistics of all operations, as a {(kind, operation): dict} """
+        with self._lock:
+            return {key: stats.as_dict() for key, stats in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+NO_INSTRUMENTATION = Instrumentation()
@@ -0,0 +1,87 @@
+# Copyright 2019 ML2Grow NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import copy
+import threading
+from concurrent.futures import Future
+
+
+class _Batch:
+    __slots__ = ('collection', 'cache', 'waiters', 'full')
+
+    def __init__(self, collection, cache):
+        self.collection = collection
+        self.cache = cache
+        self.waiters = {}
+        self.full = threading.Event()
+
+
+class DataLoader:
+    """
+    Coalesces the single key lookups of concurrent threads (or coroutines through the executor) into
+    one get_multi per kind.
+
+    The first lookup of a kind opens a batch and waits window seconds, or until max_batch distinct
+    keys were requested, before retrieving the whole batch on behalf of all callers. Identical keys
+    are retrieved once, every caller still gets its own document.
+
+    Enable it by passing a DataLoader to DataStoreInstance.init, Document.get and DataStoreReference.fetch
+    then go through it. Lookups within a batch or transaction bypass the loader.
+    """
+
+    def __init__(self, window=0.002, max_batch=100):
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._batches = {}
+
+    def load(self, document_cls, pk):
+        """ Return the entity of pk in the collection of document_cls, or None if it does not exist """
+        collection = document_cls.collection
+        key = collection.key(pk)
+        future = Future()
+        kind = document_cls.opts.collection_name
+        with self._lock:
+            batch = self._batches.get(kind)
+            leader = batch is None
+            if leader:
+                batch = self._batches[kind] = _Batch(collection, document_cls.opts.cache)
+            batch.waiters.setdefault(key, []).append(future)
+            if len(batch.waiters) >= self.max_batch:
+                del self._batches[kind]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batches.get(kind) is batch:
+                    del self._batches[kind]
+            self._dispatch(batch)
+        return future.result()
+
+    @staticmethod
+    def _dispatch(batch):
+        keys = list(batch.waiters)
+        try:
+            entities = batch.collection.get_multi(keys, cache=batch.cache, raw=True)
+        except Exception as exc:  # pylint: disable=W0703
+            for futures in batch.waiters.values():
+                for future in futures:
+                    future.set_exception(exc)
+            return
+        for key, entity in zip(keys, entities):
+            first, *others = batch.waiters[key]
+            first.set_result(entity)
+            # Documents built from the same entity would share its mutable values
+            for future in others:
+                future.set_result(copy.deepcopy(entity))
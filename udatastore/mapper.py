@@ -0,0 +1,149 @@
+# Copyright 2019 ML2Grow NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import collections
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .helpers import chunked
+
+# Document classes and functions being mapped, inherited by the forked workers as neither can be pickled
+_MAPPED = {}
+_tokens = itertools.count()
+# Tokens of the maps whose initializer ran in this process
+_initialized = set()
+_initialize_lock = threading.Lock()
+
+
+class MapError(RuntimeError):
+    """ A worker can't run the map, its process wasn't forked from the one calling map """
+
+
+class MapReport:
+    """
+    Progress of Document.map, updated as chunks complete.
+
+    failed holds the keys of the documents which were not written because of an error, errors holds
+    (keys, exception) tuples with the cause, for a single document (fn failed) or a whole chunk.
+    """
+
+    def __init__(self):
+        self.processed = 0
+        self.written = 0
+        self.missing = 0
+        self.failed = []
+        self.errors = []
+        self._start = time.monotonic()
+        self.seconds = 0.0
+
+    @property
+    def throughput(self):
+        """ Processed documents per second """
+        return self.processed / self.seconds if self.seconds else 0.0
+
+    def _update(self, processed, written, missing, errors):
+        self.processed += processed
+        self.written += written
+        self.missing += missing
+        for keys, _ in errors:
+            self.failed.extend(keys)
+        self.errors.extend(errors)
+        self.seconds = time.monotonic() - self._start
+
+    def __repr__(self):
+        return '<MapReport processed={0} written={1} missing={2} failed={3} throughput={4:.1f}/s>'.format(
+            self.processed, self.written, self.missing, len(self.failed), self.throughput)
+
+
+def _map_chunk(token, keys):
+    """ Runs in the workers: retrieve the documents of keys, apply the function and commit the modified ones """
+    try:
+        document_cls, fn, io_validate_all, initializer = _MAPPED[token]
+    except KeyError:
+        raise MapError('The map is unknown to this worker, only workers started after map was called '
+                       '(threads, or processes forked on demand) can run it') from None
+    if initializer is not None:
+        with _initialize_lock:
+            if token not in _initialized:
+                initializer()
+                _initialized.add(token)
+    docs = document_cls.get_multi(keys)
+    mapped, errors = [], []
+    for key, doc in zip(keys, docs):
+        if doc is None:
+            continue
+        try:
+            fn(doc)
+        except Exception as exc:  # pylint: disable=W0703
+            errors.append(([key], exc))
+            continue
+        if doc.is_modified():
+            mapped.append(doc)
+    try:
+        document_cls.commit_multi(mapped, io_validate_all=io_validate_all)
+    except Exception as exc:  # pylint: disable=W0703
+        errors.append(([doc.pk for doc in mapped], exc))
+        mapped = []
+    return len(keys) - docs.count(None), len(mapped), docs.count(None), errors
+
+
+def map_documents(document_cls, fn, filters=None, workers=None, chunk_size=100, executor=None,
+                  initializer=None, io_validate_all=False, progress=None, ancestor=None):
+    """
+    Apply fn to the documents matching the filters in a pool of processes, see Document.map.
+    """
+    # pylint: disable=R0913,R0914
+    report = MapReport()
+    token = next(_tokens)
+    _MAPPED[token] = document_cls, fn, io_validate_all, initializer
+    owned = executor is None
+    if owned:
+        # Fork is the default on Linux, the start method can only be chosen as of Python 3.7
+        options = {'mp_context': multiprocessing.get_context('fork')} if sys.version_info >= (3, 7) else {}
+        executor = ProcessPoolExecutor(max_workers=workers, **options)
+    keys = document_cls.find(filters, keys_only=True, ancestor=ancestor)
+    chunks = chunked(keys, chunk_size)
+    # Bound the chunks in flight, keys are only pulled from the query as workers free up
+    max_pending = 2 * (workers or os.cpu_count() or 1)
+    pending = collections.OrderedDict()
+
+    def collect(done):
+        for future in done:
+            chunk = pending.pop(future)
+            try:
+                result = future.result()
+            except MapError:
+                raise
+            except Exception as exc:  # pylint: disable=W0703
+                result = len(chunk), 0, 0, [(chunk, exc)]
+            report._update(*result)  # pylint: disable=W0212
+            if progress is not None:
+                progress(report)
+
+    try:
+        for chunk in chunks:
+            pending[executor.submit(_map_chunk, token, chunk)] = chunk
+            if len(pending) >= max_pending:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+        while pending:
+            collect(wait(pending, return_when=FIRST_COMPLETED).done)
+    finally:
+        if owned:
+            executor.shutdown()
+        del _MAPPED[token]
+    return report
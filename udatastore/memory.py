@@ -0,0 +1,364 @@
+# Copyright 2019 ML2Grow NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import threading
+import time
+import zlib
+
+from google.cloud import datastore
+
+from .helpers import _sort_value
+
+
+_MISSING = object()
+
+_OPERATORS = {
+    '=': lambda a, b: a == b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+def _copy_value(value):
+    if isinstance(value, datastore.Entity):
+        copied = datastore.Entity(key=value.key, exclude_from_indexes=tuple(value.exclude_from_indexes))
+        copied.update({k: _copy_value(v) for k, v in value.items()})
+        return copied
+    if isinstance(value, dict):
+        return {k: _copy_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_value(v) for v in value]
+    return value
+
+
+def _property(entity, name):
+    """ Value of a (dotted) property, traversing embedded entities and lists of them """
+    if name == '__key__':
+        return entity.key
+    if name == '__scatter__':
+        # Datastore assigns a random scatter value to (a fraction of the) entities, to sample keys
+        return zlib.crc32(repr(entity.key.flat_path).encode())
+    value = entity
+    for part in name.split('.'):
+        if isinstance(value, list):
+            value = [v[part] for v in value if isinstance(v, dict) and part in v] or _MISSING
+        elif isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+
+def _order_value(value, descending):
+    # Lists are sorted on their smallest value ascending, on their largest value descending
+    if isinstance(value, list):
+        values = list(map(_sort_value, value))
+        return max(values) if descending else min(values)
+    return _sort_value(value)
+
+
+def _matches(entity, name, operator, operand):
+    value = _property(entity, name)
+    if value is _MISSING:
+        return False
+    values = value if isinstance(value, list) else [value]
+    expected = _sort_value(operand)
+    return any(_OPERATORS[operator](_sort_value(v), expected) for v in values)
+
+
+class MemoryQuery(datastore.Query):
+    """ Query evaluated against the entities of a MemoryClient """
+
+    def fetch(self, limit=None, offset=0, start_cursor=None, end_cursor=None, client=None, eventual=False):
+        # pylint: disable=R0913
+        return MemoryIterator(self, client or self._client, limit=limit, offset=offset,
+                              start_cursor=start_cursor, end_cursor=end_cursor)
+
+
+class MemoryIterator:  # pylint: disable=R0902
+    """
+    Mimics google.cloud.datastore.query.Iterator: results are returned in pages of batch_size
+    entities, each page counting as one RPC. Cursors are positions in the results.
+    """
+
+    def __init__(self, query, client, limit=None, offset=0, start_cursor=None, end_cursor=None):
+        # pylint: disable=R0913
+        self._query = query
+        self.client = client
+        self.max_results = limit
+        self.num_results = 0
+        self.next_page_token = start_cursor
+        self._offset = offset or 0
+        self._start = int(start_cursor) if start_cursor else 0
+        self._end = int(end_cursor) if end_cursor else None
+        self._started = False
+
+    def _results(self):
+        query = self._query
+        entities = self.client._entities(query.kind, query.namespace)  # pylint: disable=W0212
+        if query.ancestor is not None:
+            path = query.ancestor.flat_path
+            entities = [e for e in entities if e.key.flat_path[:len(path)] == path]
+        for name, operator, operand in query.filters:
+            entities = [e for e in entities if _matches(e, name, operator, operand)]
+        for order in reversed(query.order):
+            name = order.lstrip('-')
+            entities = [e for e in entities if _property(e, name) is not _MISSING]
+            descending = order.startswith('-')
+            entities.sort(key=lambda e, n=name, d=descending: _order_value(_property(e, n), d), reverse=descending)
+        return entities
+
+    def _project(self, entity):
+        projection = self._query.projection
+        if not projection:
+            return _copy_value(entity)
+        projected = datastore.Entity(key=entity.key)
+        for name in projection:
+            if name != '__key__' and name in entity:
+                projected[name] = _copy_value(entity[name])
+        return projected
+
+    @property
+    def pages(self):
+        if self._started:
+            raise ValueError('Iterator has already started', self)
+        self._started = True
+        return self._pages()
+
+    def _pages(self):
+        results = self._results()
+        position = self._start + self._offset
+        end = len(results) if self._end is None else min(self._end, len(results))
+        while position < end:
+            size = self.client.batch_size
+            if self.max_results is not None:
+                size = min(size, self.max_results - self.num_results)
+                if size <= 0:
+                    break
+            self.client._rpc()  # pylint: disable=W0212
+            page = [self._project(e) for e in results[position:min(position + size, end)]]
+            position += len(page)
+            self.num_results += len(page)
+            self.next_page_token = str(position).encode()
+            yield page
+        if position >= end:
+            self.next_page_token = None
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+
+class MemoryBatch:
+    """ Collects mutations, applied at once on commit """
+
+    def __init__(self, client):
+        self._client = client
+        self._puts = []
+        self._deletes = []
+
+    def begin(self):
+        self._client._push_batch(self)  # pylint: disable=W0212
+
+    def put(self, entity):
+        self._puts.append(entity)
+
+    def delete(self, key):
+        self._deletes.append(key)
+
+    def commit(self):
+        try:
+            self._client._commit(self._puts, self._deletes)  # pylint: disable=W0212
+        finally:
+            self._client._pop_batch()  # pylint: disable=W0212
+
+    def rollback(self):
+        self._client._pop_batch()  # pylint: disable=W0212
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+class MemoryTransaction(MemoryBatch):
+    _ids = itertools.count(1)
+
+    def __init__(self, client, read_only=False):
+        super().__init__(client)
+        self.read_only = read_only
+        self.id = None  # pylint: disable=C0103
+
+    def begin(self):
+        super().begin()
+        self.id = next(self._ids)
+
+
+class MemoryClient:  # pylint: disable=R0902
+    """
+    In-memory stand-in for google.cloud.datastore.Client.
+
+    Implements the subset used by udatastore: key, get(_multi), put(_multi), delete(_multi), query
+    (filters, order, including on __scatter__, ancestor, projection, limit, offset and cursors),
+    batch and transaction.
+    Every round-trip is counted in rpc_count and can be slowed down with latency (seconds, or a
+    callable returning seconds), which allows to measure the overhead of udatastore itself.
+    """
+
+    def __init__(self, project='udatastore', namespace=None, latency=0.0, batch_size=300):
+        self.project = project
+        self.namespace = namespace
+        self.latency = latency
+        self.batch_size = batch_size
+        self.rpc_count = 0
+        self._kinds = {}
+        self._sorted = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def _rpc(self):
+        with self._lock:
+            self.rpc_count += 1
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            time.sleep(latency)
+
+    def _batches(self):
+        if not hasattr(self._local, 'batches'):
+            self._local.batches = []
+        return self._local.batches
+
+    def _push_batch(self, batch):
+        self._batches().append(batch)
+
+    def _pop_batch(self):
+        return self._batches().pop()
+
+    @property
+    def current_batch(self):
+        batches = self._batches()
+        return batches[-1] if batches else None
+
+    @property
+    def current_transaction(self):
+        batch = self.current_batch
+        return batch if isinstance(batch, MemoryTransaction) else None
+
+    def _entities(self, kind, namespace):
+        """ Entities of a kind, in key order """
+        with self._lock:
+            entities = self._sorted.get((namespace, kind))
+            if entities is None:
+                entities = sorted(self._kinds.get((namespace, kind), {}).values(),
+                                  key=lambda e: _sort_value(e.key))
+                self._sorted[(namespace, kind)] = entities
+            return entities
+
+    def _commit(self, puts, deletes):
+        self._rpc()
+        with self._lock:
+            for entity in puts:
+                if entity.key.is_partial:
+                    entity.key = entity.key.completed_key(next(self._ids))
+                kind = (entity.key.namespace, entity.key.kind)
+                self._kinds.setdefault(kind, {})[entity.key] = _copy_value(entity)
+                self._sorted.pop(kind, None)
+            for key in deletes:
+                kind = (key.namespace, key.kind)
+                self._kinds.get(kind, {}).pop(key, None)
+                self._sorted.pop(kind, None)
+
+    def key(self, *path_args, **kwargs):
+        if 'project' in kwargs:
+            raise TypeError('Cannot pass project')
+        kwargs['project'] = self.project
+        kwargs.setdefault('namespace', self.namespace)
+        return datastore.Key(*path_args, **kwargs)
+
+    def allocate_ids(self, incomplete_key, num_ids):
+        self._rpc()
+        with self._lock:
+            return [incomplete_key.completed_key(next(self._ids)) for _ in range(num_ids)]
+
+    def query(self, **kwargs):
+        if 'client' in kwargs:
+            raise TypeError('Cannot pass client')
+        if 'project' in kwargs:
+            raise TypeError('Cannot pass project')
+        kwargs['project'] = self.project
+        kwargs.setdefault('namespace', self.namespace)
+        return MemoryQuery(self, **kwargs)
+
+    def batch(self):
+        return MemoryBatch(self)
+
+    def transaction(self, **kwargs):
+        return MemoryTransaction(self, **kwargs)
+
+    def get(self, key, missing=None, deferred=None, transaction=None, eventual=False):
+        # pylint: disable=W0613
+        entities = self.get_multi([key], missing=missing, deferred=deferred)
+        return entities[0] if entities else None
+
+    def get_multi(self, keys, missing=None, deferred=None, transaction=None, eventual=False):
+        # pylint: disable=W0613
+        if not keys:
+            return []
+        self._rpc()
+        found = []
+        with self._lock:
+            for key in keys:
+                entity = self._kinds.get((key.namespace, key.kind), {}).get(key)
+                if entity is not None:
+                    found.append(_copy_value(entity))
+                elif missing is not None:
+                    missing.append(datastore.Entity(key=key))
+        return found
+
+    def put(self, entity):
+        self.put_multi([entity])
+
+    def put_multi(self, entities):
+        if isinstance(entities, datastore.Entity):
+            raise ValueError('Pass a sequence of entities')
+        if not entities:
+            return
+        current = self.current_batch
+        if current is None:
+            self._commit(list(entities), [])
+        else:
+            for entity in entities:
+                current.put(entity)
+
+    def delete(self, key):
+        self.delete_multi([key])
+
+    def delete_multi(self, keys):
+        if not keys:
+            return
+        current = self.current_batch
+        if current is None:
+            self._commit([], list(keys))
+        else:
+            for key in keys:
+                current.delete(key)
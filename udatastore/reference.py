@@ -13,6 +13,8 @@
 # limitations under the License.
 
 from umongo.data_objects import Reference
+from umongo.document import DocumentImplementation
+from umongo.embedded_document import EmbeddedDocumentImplementation
 from umongo.exceptions import ValidationError
 
 
@@ -27,7 +29,57 @@ class DataStoreReference(Reference):
         if not self._document or force_reload:
             if self.pk is None:
                 raise ReferenceError('Cannot retrieve a None Reference')
-            self._document = self.document_cls.find_one({'_id': self.pk})
+            self._document = self.document_cls.get(self.pk)
             if not self._document:
                 raise ValidationError(self.error_messages['not_found'].format(document=self.document_cls.__name__))
         return self._document
+
+
+def _resolve_references(references):
+    """
+    Fetch the documents of all unresolved references, with a single get_multi per document class.
+    """
+    per_class = {}
+    for reference in references:
+        if reference._document is None and reference.pk is not None:  # pylint: disable=W0212
+            per_class.setdefault(reference.document_cls, []).append(reference)
+
+    for document_cls, cls_references in per_class.items():
+        pks = list({reference.pk: None for reference in cls_references})
+        documents = dict(zip(pks, document_cls.get_multi(pks)))
+        for reference in cls_references:
+            reference._document = documents[reference.pk]  # pylint: disable=W0212
+
+
+def _collect(objs, name):
+    values = []
+    for obj in objs:
+        value = obj[name]
+        if isinstance(value, list):
+            values.extend(value)
+        elif value is not None:
+            values.append(value)
+    return values
+
+
+def prefetch(docs, *paths):
+    """
+    Resolve the references found on the given (dotted) paths of a batch of documents.
+
+    Paths may traverse ListFields, EmbeddedFields and ReferenceFields, e.g. prefetch(docs, 'friends', 'owner.team').
+    Referenced documents are fetched per kind in one get_multi, and cached on the references so subsequent
+    calls to fetch() do not hit datastore.
+    """
+    docs = list(docs)
+    for path in paths:
+        objs = docs
+        for name in path.split('.'):
+            values = _collect(objs, name)
+            _resolve_references([v for v in values if isinstance(v, DataStoreReference)])
+            objs = []
+            for value in values:
+                if isinstance(value, DataStoreReference):
+                    value = value._document  # pylint: disable=W0212
+                if isinstance(value, (DocumentImplementation, EmbeddedDocumentImplementation)):
+                    objs.append(value)
+    return docs
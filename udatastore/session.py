@@ -0,0 +1,80 @@
+# Copyright 2019 ML2Grow NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+
+
+class Session:
+    """
+    Identity map of the documents loaded within a `with instance.session():` block.
+
+    Inside a session, loading a key again (get, get_multi, reference fetch or prefetch) returns
+    the same document object without hitting datastore, and documents returned by find are
+    swapped for the already loaded instance of the same key.
+
+    With defer_commits, Document.commit only registers the document as pending. Pending documents
+    are written by flush, with one commit_multi per document class, which happens automatically
+    when the block exits without error.
+    """
+
+    def __init__(self, instance, defer_commits=False):
+        self.instance = instance
+        self.defer_commits = defer_commits
+        self._identity_map = {}
+        self._pending = collections.OrderedDict()
+
+    def __enter__(self):
+        self.instance._push_session(self)  # pylint: disable=W0212
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.instance._pop_session()  # pylint: disable=W0212
+
+    def get(self, key):
+        """
+        Return the loaded document with the given key, or None.
+        """
+        return self._identity_map.get(key)
+
+    def register(self, doc):
+        """
+        Add a loaded document to the identity map, returns the document already registered for its key if any.
+        """
+        if not doc.is_created or doc._data.partial:  # pylint: disable=W0212
+            return doc
+        return self._identity_map.setdefault(doc.pk, doc)
+
+    def evict(self, key):
+        self._identity_map.pop(key, None)
+
+    def add(self, doc):
+        """
+        Register a document to be committed on the next flush.
+        """
+        self._pending[id(doc)] = doc
+
+    def flush(self):
+        """
+        Commit the pending documents, batched per document class.
+        """
+        per_class = collections.OrderedDict()
+        for doc in self._pending.values():
+            per_class.setdefault(type(doc), []).append(doc)
+        self._pending.clear()
+        for document_cls, docs in per_class.items():
+            document_cls.commit_multi(docs)
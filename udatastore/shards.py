@@ -0,0 +1,101 @@
+# Copyright 2019 ML2Grow NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+
+from google.cloud import datastore
+
+# Kind of the child entities holding the shards of a blob, keyed by '<property>:<index>' under their parent
+SHARD_KIND = 'UdatastoreShard'
+
+# Stored in place of a sharded blob: the BytesField header with codec id 255, followed by the shard count and size
+_MANIFEST = b'\x00\xff\x00'
+_MANIFEST_FORMAT = '<II'
+
+
+def is_manifest(value):
+    return isinstance(value, bytes) and value.startswith(_MANIFEST)
+
+
+def shard_keys(key, name, count):
+    """ Keys of the count shards of property name of the entity with the given key """
+    return [datastore.Key(SHARD_KIND, '{0}:{1}'.format(name, index), parent=key) for index in range(count)]
+
+
+def count_of(value):
+    """ Number of shards of a stored value, 0 unless it is a manifest """
+    if not is_manifest(value):
+        return 0
+    count, _ = struct.unpack_from(_MANIFEST_FORMAT, value, len(_MANIFEST))
+    return count
+
+
+def keys_of(entity):
+    """ Keys of the shards of all sharded properties of an entity, read from their manifests """
+    keys = []
+    for name, value in entity.items():
+        keys.extend(shard_keys(entity.key, name, count_of(value)))
+    return keys
+
+
+def stale_keys(key, name, stored, value):
+    """ Keys of the shards of the stored value of property name left over once value replaces it """
+    return shard_keys(key, name, count_of(stored))[count_of(value):]
+
+
+def split(key, name, value, shard_size):
+    """
+    Split value in shards of at most shard_size bytes, stored as children of key.
+
+    Returns the manifest to store instead of value and the shard entities.
+    """
+    count = (len(value) + shard_size - 1) // shard_size
+    children = []
+    view = memoryview(value)
+    for index, shard_key in enumerate(shard_keys(key, name, count)):
+        entity = datastore.Entity(key=shard_key, exclude_from_indexes=('data', ))
+        entity['data'] = bytes(view[index * shard_size:(index + 1) * shard_size])
+        children.append(entity)
+    return _MANIFEST + struct.pack(_MANIFEST_FORMAT, count, len(value)), children
+
+
+class Shards:
+    """
+    Placeholder for a sharded blob in the DataProxy, the shards are fetched and decoded by load.
+    """
+    __slots__ = ('field', 'manifest', 'count', 'size')
+
+    def __init__(self, field, manifest):
+        self.field = field
+        self.manifest = manifest
+        self.count, self.size = struct.unpack_from(_MANIFEST_FORMAT, manifest, len(_MANIFEST))
+
+    def load(self, key, name):
+        """
+        Fetch the shards of property name of the entity with the given key and decode the blob.
+        Shards are retrieved through the shard collection, using the cache of the document if any.
+        """
+        keys = shard_keys(key, name, self.count)
+        collection = self.field.instance.db[SHARD_KIND]
+        entities = collection.get_multi(keys, cache=self.field.shard_cache, raw=True)
+        missing = [shard_key.name for shard_key, entity in zip(keys, entities) if entity is None]
+        if missing:
+            raise ValueError("Missing shard {0!r} of {1}".format(missing[0], key))
+        value = b''.join(entity['data'] for entity in entities)
+        if len(value) != self.size:
+            raise ValueError("Shards of {0} hold {1} bytes, expected {2}".format(key, len(value), self.size))
+        return self.field.decode(value)
+
+    def __repr__(self):
+        return '<Shards {0} x {1} bytes>'.format(self.count, self.size)
@@ -0,0 +1,232 @@
+# Copyright 2019 ML2Grow NV
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import itertools
+import random
+import time
+
+from google.api_core import exceptions
+from umongo.exceptions import NotCreatedError
+
+from .helpers import BatchError
+
+# Contention and transient errors, retried by Transaction
+RETRYABLE_ERRORS = (
+    exceptions.Aborted,
+    exceptions.Conflict,
+    exceptions.DeadlineExceeded,
+    exceptions.GatewayTimeout,
+    exceptions.InternalServerError,
+    exceptions.ResourceExhausted,
+    exceptions.ServiceUnavailable,
+    exceptions.TooManyRequests,
+)
+
+Attempt = collections.namedtuple('Attempt', ['number', 'duration', 'error', 'delay'])
+Attempt.__doc__ = """
+Metrics of a commit attempt: duration in seconds, the error it failed with (None on success)
+and the delay before the next attempt (None if there is none).
+"""
+
+
+def is_retryable(exc):
+    """ Whether exc is a contention or transient error, for BatchErrors if all failures are """
+    if isinstance(exc, BatchError):
+        return all(is_retryable(failure) for _, failure in exc.failures)
+    return isinstance(exc, RETRYABLE_ERRORS)
+
+
+class Transaction:  # pylint: disable=R0902
+    """
+    Writes of a `with instance.transaction():` block, committed in a single datastore transaction.
+
+    Inside the block Document.commit(_multi) and Document.delete(_multi) register the documents
+    instead of writing them. When the block exits without error, the documents are validated and
+    all puts and deletes are committed at once. Validation errors are raised as is, contention and
+    transient errors (see RETRYABLE_ERRORS) are retried with jittered exponential backoff until
+    the deadline (in seconds) passes. Each attempt is recorded in attempts.
+    """
+
+    # Mutations allowed in a single commit
+    MAX_MUTATIONS = 500
+
+    def __init__(self, instance, deadline=30.0, initial_delay=0.1, max_delay=5.0, multiplier=2.0,
+                 io_validate_all=False):
+        # The retry policy is set per transaction
+        # pylint: disable=R0913
+        self.instance = instance
+        self.deadline = deadline
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.io_validate_all = io_validate_all
+        self.attempts = []
+        self._puts = collections.OrderedDict()
+        self._deletes = collections.OrderedDict()
+
+    def __enter__(self):
+        self.instance._push_transaction(self)  # pylint: disable=W0212
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            self.instance._pop_transaction()  # pylint: disable=W0212
+
+    def add(self, doc):
+        """
+        Register a document to be written on commit.
+        """
+        self._deletes.pop(id(doc), None)
+        self._puts[id(doc)] = doc
+
+    def delete(self, doc):
+        """
+        Register a document to be deleted on commit.
+        """
+        if not doc.is_created:
+            raise NotCreatedError("Document doesn't exists in database")
+        self._puts.pop(id(doc), None)
+        self._deletes[id(doc)] = doc
+
+    def commit(self):
+        """
+        Validate the registered documents and commit them, retrying contention and transient errors.
+        """
+        # pylint: disable=W0212
+        puts = collections.OrderedDict()
+        for doc in self._puts.values():
+            puts.setdefault(type(doc), []).append(doc)
+        prepared = [(document_cls, list(document_cls._prepare_commit(docs, self.io_validate_all)))
+                    for document_cls, docs in puts.items()]
+        deletes = list(self._deletes.values())
+        self._puts.clear()
+        self._deletes.clear()
+        self._complete_keys(prepared)
+
+        start = time.monotonic()
+        delay = self.initial_delay
+        for number in itertools.count(1):
+            began = time.monotonic()
+            try:
+                self._attempt(prepared, deletes)
+            except Exception as exc:  # pylint: disable=W0703
+                now = time.monotonic()
+                pause = delay * random.random()
+                retry = is_retryable(exc) and now + pause - start < self.deadline
+                self.attempts.append(Attempt(number, now - began, exc, pause if retry else None))
+                if not retry:
+                    raise
+                time.sleep(pause)
+                delay = min(delay * self.multiplier, self.max_delay)
+            else:
+                self.attempts.append(Attempt(number, time.monotonic() - began, None, None))
+                return
+
+    def _complete_keys(self, prepared):
+        """
+        Allocate the ids of new documents up front. An attempt failing with a transient error may still
+        have been committed, the next attempts must overwrite the same entities instead of inserting again.
+        """
+        client = self.instance.db.client
+        # Partial keys never compare equal, group them by path
+        partial = collections.OrderedDict()
+        for document_cls, items in prepared:
+            for _, payload in items:
+                key = document_cls.collection.key(payload.get('_id'))
+                if key.is_partial:
+                    partial.setdefault(key.flat_path, (key, []))[1].append(payload)
+        for key, payloads in partial.values():
+            for payload, complete in zip(payloads, client.allocate_ids(key, len(payloads))):
+                payload['_id'] = complete
+
+    @staticmethod
+    def _pack(prepared):
+        """
+        Pack the prepared documents, returning (doc, entity, payload, evicted keys) tuples, the entities
+        to put, including the shards, and the keys of the shards left over by values which shrank.
+        """
+        # pylint: disable=W0212
+        written, entities, stale_keys = [], [], []
+        for document_cls, items in prepared:
+            collection = document_cls.collection
+            exclude_from_indexes = document_cls.excluded_properties()
+            sharded = document_cls.DataProxy._sharded_fields
+            for doc, payload in items:
+                # Packing consumes the payload, keep the original for the next attempts
+                payload = dict(payload)
+                children = []
+                if sharded:
+                    entity, children = collection._pack_sharded(payload, exclude_from_indexes, sharded)
+                    entities.extend(children)
+                else:
+                    entity = collection._pack(payload, exclude_from_indexes)
+                entities.append(entity)
+                stale = doc._data.stale_shards(entity.key, payload)
+                stale_keys.extend(stale)
+                written.append((doc, entity, payload, [child.key for child in children] + stale))
+        return written, entities, stale_keys
+
+    @staticmethod
+    def _delete_keys(deletes):
+        """
+        Keys of the deleted documents and of their shards, along with the keys of the shards per document.
+        """
+        # pylint: disable=W0212
+        keys = [doc.pk for doc in deletes]
+        sharded_keys = [doc.pk for doc in deletes if doc.DataProxy._sharded_fields]
+        shard_keys = collections.defaultdict(list)
+        if sharded_keys:
+            for shard_key in deletes[0].collection._shard_keys(sharded_keys):
+                shard_keys[shard_key.parent].append(shard_key)
+                keys.append(shard_key)
+        return keys, shard_keys
+
+    def _attempt(self, prepared, deletes):
+        # pylint: disable=W0212
+        client = self.instance.db.client
+        written, entities, stale_keys = self._pack(prepared)
+        keys, shard_keys = self._delete_keys(deletes)
+        keys += stale_keys
+        mutations = len(entities) + len(keys)
+        if mutations > self.MAX_MUTATIONS:
+            raise ValueError("Transaction holds {0} mutations, at most {1} are allowed".format(
+                mutations, self.MAX_MUTATIONS))
+
+        with client.transaction():
+            client.put_multi(entities)
+            client.delete_multi(keys)
+
+        # Keys of new entities are complete once committed
+        session = self.instance.current_session
+        for doc, entity, payload, evicted in written:
+            if not doc.is_created:
+                doc._data.set_by_mongo_name('_id', entity.key)
+            doc.is_created = True
+            doc._data.clear_modified()
+            doc._data.remember_encoded(payload)
+            if doc.opts.cache is not None:
+                doc.opts.cache.set_multi([entity])
+                doc.opts.cache.delete_multi(evicted)
+            if session is not None:
+                session.register(doc)
+        for doc in deletes:
+            if doc.opts.cache is not None:
+                doc.opts.cache.delete_multi([doc.pk] + shard_keys[doc.pk])
+            if session is not None:
+                session.evict(doc.pk)
+            doc.is_created = False